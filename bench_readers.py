@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+bench_readers.py
+
+Compares the bulk 1a file reader of radflux_utils with the former
+np.loadtxt + datestr2num path on the daily files found in a data directory.
+
+usage: python bench_readers.py [datadir] [repeat]
+"""
+
+import sys
+import glob
+import time as timer
+
+import numpy as np
+
+from radflux_utils import read_1a_file
+
+
+def legacy_read(filename):
+
+    import matplotlib.dates as mdates
+    # the meteo headers hold latin-1 degree signs
+    x = np.loadtxt(filename, converters={0:mdates.datestr2num}, encoding='latin1')
+    time = mdates.num2epoch(x[:,0])
+    return time, x[:,1:]
+
+
+def bench(reader, files, repeat):
+
+    best = None
+    for i in range(repeat):
+        t0 = timer.time()
+        for f in files:
+            reader(f)
+        dt = timer.time() - t0
+        if best is None or dt < best:
+            best = dt
+    return best
+
+
+def main():
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    files = sorted(glob.glob(path + '/radflux_1a_*.txt') + glob.glob(path + '/meteoz1_1a_*.asc'))
+    if len(files) < 1:
+        print 'No 1a files in ', path
+        return
+
+    for f in files:
+        t1, x1 = legacy_read(f)
+        t2, x2 = read_1a_file.uncached(f)
+        # datestr2num goes through float days, allow sub-millisecond rounding
+        assert np.allclose(t1, t2, rtol=0, atol=1e-3), f
+        assert np.allclose(x1, x2, equal_nan=True), f
+
+    nlines = sum([len(read_1a_file.uncached(f)[0]) for f in files])
+    print '%d files, %d lines, best of %d' % (len(files), nlines, repeat)
+    tlegacy = bench(legacy_read, files, repeat)
+    tfast = bench(read_1a_file.uncached, files, repeat)
+    print 'loadtxt + datestr2num : %8.4f s (%8.0f lines/s)' % (tlegacy, nlines / tlegacy)
+    print 'read_1a_file          : %8.4f s (%8.0f lines/s)' % (tfast, nlines / tfast)
+    print 'speedup               : %8.1fx' % (tlegacy / tfast)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+bench_startup.py
+
+Cold start cost of importing the compute entry point (radflux_api by
+default) in a fresh interpreter, as paid by every batch worker.
+
+The import tree is taken from python -X importtime when the interpreter has
+it (3.7+), otherwise from an __import__ hook printing the same format.
+Reports the total, the most expensive modules, any heavy backend or GUI
+package that got imported, and the wall time of the child process.
+
+usage: python bench_startup.py [module] [repeat]
+"""
+
+import os
+import re
+import sys
+import subprocess
+import time as timer
+
+
+# packages that the compute entry point should not import at startup
+HEAVY = ['h5py', 'scipy', 'netCDF4', 'matplotlib', 'chaco', 'enable', 'kiva', 'traits', 'traitsui', 'pyface', 'reportlab', 'PIL']
+
+# the -X importtime report, for interpreters without it
+HOOK = '''
+import sys, time
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+_import = builtins.__import__
+stack = [0.]
+def timed_import(name, *args, **kwargs):
+    if name in sys.modules:
+        return _import(name, *args, **kwargs)
+    stack.append(0.)
+    t0 = time.time()
+    try:
+        return _import(name, *args, **kwargs)
+    finally:
+        total = time.time() - t0
+        children = stack.pop()
+        stack[-1] += total
+        sys.stderr.write('import time: %%9d | %%10d | %%s%%s\\n' %% ((total - children) * 1e6, total * 1e6, '  ' * (len(stack) - 1), name))
+builtins.__import__ = timed_import
+import %s
+'''
+
+line_pattern = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+
+
+def run(args):
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.abspath(__file__)), env.get('PYTHONPATH', '')])
+    p = subprocess.Popen([sys.executable] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    out, err = p.communicate()
+    return p.returncode, err.decode('utf-8', 'replace')
+
+
+def import_tree(module):
+    '''
+    list of (self us, cumulative us, depth, name) for the modules imported
+    by a fresh interpreter importing module, and the method used
+    '''
+
+    code, err = run(['-X', 'importtime', '-c', 'import ' + module])
+    method = '-X importtime'
+    if code != 0 or 'import time:' not in err:
+        code, err = run(['-c', HOOK % module])
+        method = '__import__ hook'
+    if code != 0:
+        raise RuntimeError('import %s failed:\n%s' % (module, err))
+
+    tree = []
+    for line in err.splitlines():
+        match = line_pattern.match(line)
+        if match is not None:
+            tree.append((int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+    return tree, method
+
+
+def wall_time(module, repeat):
+
+    best = None
+    for i in range(repeat):
+        t0 = timer.time()
+        run(['-c', 'import ' + module])
+        dt = timer.time() - t0
+        if best is None or dt < best:
+            best = dt
+    return best
+
+
+def main():
+
+    module = sys.argv[1] if len(sys.argv) > 1 else 'radflux_api'
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    tree, method = import_tree(module)
+    total = sum([cumulative for (self_us, cumulative, depth, name) in tree if depth == 0])
+    print 'import %s: %.1f ms (%s, %d modules)' % (module, total / 1000., method, len(tree))
+    print
+    print 'slowest modules, cumulative ms:'
+    for self_us, cumulative, depth, name in sorted(tree, key=lambda x: -x[1])[:15]:
+        print '  %8.1f  %s' % (cumulative / 1000., name)
+
+    imported = set([name.split('.')[0] for (self_us, cumulative, depth, name) in tree])
+    heavy = [name for name in HEAVY if name in imported]
+    print
+    print 'heavy packages imported: ' + (', '.join(heavy) if heavy else 'none')
+
+    bare = wall_time('sys', repeat)
+    full = wall_time(module, repeat)
+    print 'interpreter start %.1f ms, with import %s %.1f ms (best of %d)' % (bare * 1000., module, full * 1000., repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+bench_suite.py
+
+Benchmarks of the readers, clear-sky models, aggregation, CERES window means and
+headless rendering, on synthetic data from radflux_synth.
+
+Each benchmark runs in a fresh interpreter, so that its peak memory
+(ru_maxrss) is its own. Times are the best of a few runs. Results are
+compared with a stored baseline (bench_baseline.json), written with --save.
+Benchmarks needing chaco (RFMaps, rfts rendering) are skipped if it is missing.
+--check instead runs accuracy checks on the data of the repository (solar
+angles against the old table).
+
+usage: python bench_suite.py [--data dir] [--days n] [--months n] [--repeat n]
+                             [--baseline file] [--save] [benchmark ...]
+       python bench_suite.py --check
+"""
+
+import os
+import sys
+import glob
+import json
+import time as timer
+import argparse
+import resource
+import subprocess
+
+
+def day_files(data, kind='radflux'):
+
+    pattern = 'radflux_1a_*.txt' if kind == 'radflux' else 'meteoz1_1a_*.asc'
+    return sorted(glob.glob(os.path.join(data, 'days', pattern)))
+
+
+def ceres_file(data, ext='.nc'):
+
+    return sorted(glob.glob(os.path.join(data, 'ceres', 'CERES_*' + ext)))[0]
+
+
+# each benchmark is setup(data) -> state, then run(state) is timed.
+# setups and runs import what they need, so that the child interpreter only loads that.
+
+def setup_nocache(data):
+
+    import radflux_cache
+    radflux_cache.set_cache_enabled(False)
+    return data
+
+
+def run_read_1a_radflux(data):
+
+    from radflux_utils import read_1a_file
+    for f in day_files(data):
+        read_1a_file(f)
+
+
+def run_read_1a_meteo(data):
+
+    from radflux_utils import read_1a_file
+    for f in day_files(data, 'meteo'):
+        read_1a_file(f)
+
+
+def setup_cached(data):
+
+    import radflux_cache
+    from radflux_utils import read_1a_file
+    radflux_cache.set_cache_dir(os.path.join(data, 'cache'))
+    radflux_cache.set_cache_size(4 * 1024 ** 3)
+    # fill the cache
+    for f in day_files(data):
+        read_1a_file(f)
+    return data
+
+
+def run_radflux_read(data):
+
+    from radflux_utils import radflux_read
+    for f in day_files(data):
+        radflux_read(f)
+
+
+def run_year_read(data):
+
+    from radflux_utils import radflux_year_read, meteo_year_read
+    for f in sorted(glob.glob(os.path.join(data, 'years', 'radflux_*.txt'))):
+        rf = radflux_year_read(f)
+        meteo_year_read(rf['date'].year, os.path.dirname(f))
+
+
+def run_station_series(data):
+
+    from radflux_series import load_station_series
+    load_station_series(os.path.join(data, 'days'), 0, 4e9)
+
+
+def run_ceres_nc_read(data):
+
+    from radflux_utils import ceres_nc_read
+    ceres_nc_read(ceres_file(data))
+
+
+def run_ceres_read(data):
+
+    from radflux_utils import ceres_read
+    ceres_read(ceres_file(data, '.h5'))
+
+
+def setup_clearsky(data, nsamples=5000000):
+
+    import numpy as np
+    from radflux_utils import read_1a_file
+    angle = np.concatenate([read_1a_file(f)[1][:,0] for f in day_files(data)])
+    meteo = np.concatenate([read_1a_file(f)[1][:,2:4] for f in day_files(data, 'meteo')])
+    # a decade of 1-min samples
+    ntile = -(-nsamples // min(len(angle), len(meteo)))
+    return np.tile(angle, ntile), np.tile(meteo[:,0], ntile), np.tile(meteo[:,1], ntile)
+
+
+def run_clearsky(state):
+
+    from radflux_utils import sw_clearsky, lw_clearsky
+    angle, temperature, rh = state
+    sw_clearsky(angle)
+    lw_clearsky(temperature, rh)
+
+
+def setup_aggregate(data):
+
+    from radflux_series import load_station_series
+    return load_station_series(os.path.join(data, 'days'), 0, 4e9)
+
+
+def run_aggregate(series):
+
+    from radflux_aggregate import aggregate
+    names = ['total SW flux', 'LW flux', 'sw_clearsky', 'lw_clearsky', 'sw_diff', 'lw_diff']
+    values = dict([(name, series[name]) for name in names])
+    for resolution in ('daily', 'monthly', 'diurnal'):
+        aggregate(series['time'], values, resolution)
+
+
+def setup_ceres(data):
+
+    import netCDF4
+    from radflux_utils import CeresDataset
+    return CeresDataset(ceres_file(data))
+
+
+def run_prefix_sums(dataset):
+
+    from radflux_derived import DerivedFields, CERES_FORMULAS
+    DerivedFields(dataset, CERES_FORMULAS).build_prefix_sums()
+
+
+def setup_window_means(data):
+
+    from radflux_derived import DerivedFields, CERES_FORMULAS
+    dataset = setup_ceres(data)
+    fields = DerivedFields(dataset, CERES_FORMULAS)
+    fields.build_prefix_sums()
+    return dataset, fields
+
+
+def run_window_means(state):
+
+    # what RFMaps.update_period + set_data_in_plot compute for every window
+    dataset, fields = state
+    fields.clear_cache()
+    for year in dataset.years:
+        for month_start in range(1, 13):
+            tstart, tend = dataset.window(year, month_start, 3)
+            for name in sorted(fields.formulas):
+                fields.window_mean(name, tstart, tend)
+
+
+def setup_rfmaps(data):
+
+    os.environ.setdefault('ETS_TOOLKIT', 'null')
+    from rfspace import RFMaps
+    view = RFMaps()
+    view.open_ceres_data(ceres_file(data))
+    return view
+
+
+def run_rfmaps(view):
+
+    view.climatology = None
+    view.fields.clear_cache()
+    for year in view.year_list:
+        for month_start in range(1, 13):
+            view.trait_setq(show_year=year, month_start=month_start)
+            for selector in sorted(view.formulas):
+                view.trait_setq(data_selector=selector)
+                view.update_period()
+                view.set_data_in_plot()
+
+
+def setup_render_rfts(data):
+
+    os.environ.setdefault('ETS_TOOLKIT', 'null')
+    import rfts
+    outdir = os.path.join(data, 'figures')
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    return [(f, outdir, True, True) for f in day_files(data)[:10]]
+
+
+def run_render_rfts(jobs):
+
+    from rfts_batch import render_file
+    for job in jobs:
+        result = render_file(job)
+        if result[-1] is not None:
+            raise RuntimeError(result[-1])
+
+
+def setup_render_rfspace(data):
+
+    import rfspace_batch
+    from radflux_utils import CeresDataset
+    from radflux_derived import DerivedFields, CERES_FORMULAS
+    outdir = os.path.join(data, 'maps')
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    dataset = CeresDataset(ceres_file(data))
+    rfspace_batch.init_renderer(os.path.join(data, 'ceres'), dataset.years, rfspace_batch.MAP_SIZE)
+    fields = DerivedFields(dataset, CERES_FORMULAS)
+    fields.build_prefix_sums()
+    specs = rfspace_batch.map_specs(dataset, sorted(CERES_FORMULAS), CERES_FORMULAS, dataset.years[:1],
+                                    range(1, 13, 3), [3], 'Mean', outdir)
+    return [(rfspace_batch.map_image(fields, None, dataset.month, spec), spec) for spec in specs]
+
+
+def run_render_rfspace(jobs):
+
+    from rfspace_batch import render_map
+    for job in jobs:
+        result = render_map(job)
+        if result[-1] is not None:
+            raise RuntimeError(result[-1])
+
+
+# name, setup, run
+BENCHMARKS = [
+    ('read_1a_radflux', setup_nocache, run_read_1a_radflux),
+    ('read_1a_meteo', setup_nocache, run_read_1a_meteo),
+    ('radflux_read_cached', setup_cached, run_radflux_read),
+    ('year_read', setup_nocache, run_year_read),
+    ('station_series', setup_nocache, run_station_series),
+    ('ceres_nc_read', None, run_ceres_nc_read),
+    ('ceres_read', None, run_ceres_read),
+    ('clearsky', setup_clearsky, run_clearsky),
+    ('aggregate', setup_aggregate, run_aggregate),
+    ('prefix_sums', setup_ceres, run_prefix_sums),
+    ('window_means', setup_window_means, run_window_means),
+    ('rfmaps_windows', setup_rfmaps, run_rfmaps),
+    ('render_rfts', setup_render_rfts, run_render_rfts),
+    ('render_rfspace', setup_render_rfspace, run_render_rfspace),
+]
+
+
+def check_solar_table():
+
+    from radflux_solar import compare_with_table
+    compare_with_table(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+
+
+# accuracy checks on the data of the repository, they raise an exception when failing
+CHECKS = [
+    ('solar_table', check_solar_table),
+]
+
+
+def run_checks():
+    '''
+    runs the CHECKS, returns the number of failures
+    '''
+
+    failed = 0
+    for name, check in CHECKS:
+        try:
+            check()
+        except Exception as e:
+            print '%-22s failed: %s' % (name, e)
+            failed += 1
+        else:
+            print '%-22s ok' % name
+    return failed
+
+
+def peak_memory():
+    '''
+    peak resident memory of this process in MB
+    '''
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on Mac OS, kilobytes on Linux
+    return maxrss / 1024. ** (2 if sys.platform == 'darwin' else 1)
+
+
+def run_one(name, data, repeat):
+    '''
+    runs a benchmark in this process, returns its result as a dict
+    '''
+
+    setup, run = dict([(b[0], b[1:]) for b in BENCHMARKS])[name]
+    try:
+        state = setup(data) if setup is not None else data
+    except ImportError as e:
+        return {'skipped': str(e)}
+    best = None
+    for i in range(repeat):
+        t0 = timer.time()
+        run(state)
+        dt = timer.time() - t0
+        if best is None or dt < best:
+            best = dt
+    return {'time': best, 'memory': peak_memory()}
+
+
+def run_child(name, data, repeat):
+
+    p = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--data', data, '--repeat', str(repeat), '--child', name],
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+    out, err = p.communicate()
+    lines = out.decode('utf-8', 'replace').strip().splitlines()
+    if p.returncode != 0 or len(lines) < 1:
+        return {'failed': err.decode('utf-8', 'replace').strip().splitlines()[-1:]}
+    return json.loads(lines[-1])
+
+
+def ensure_data(data, ndays, nmonths):
+    '''
+    generates the synthetic data if it is missing or was made with other sizes
+    '''
+
+    stamp = os.path.join(data, 'synthetic.json')
+    params = {'days': ndays, 'months': nmonths}
+    if os.path.isfile(stamp):
+        with open(stamp) as f:
+            if json.load(f) == params:
+                return
+
+    import radflux_synth
+    print 'Generating synthetic data in ', data
+    t0 = timer.time()
+    radflux_synth.write_station_days(os.path.join(data, 'days'), ndays=ndays)
+    # the days start on 2009-07-01
+    for year in range(2009, 2009 + (ndays + 180) // 365 + 1):
+        radflux_synth.write_station_year(os.path.join(data, 'years'), year)
+    ncfile = radflux_synth.ceres_file_name(os.path.join(data, 'ceres'), nmonths)
+    if not os.path.isdir(os.path.dirname(ncfile)):
+        os.makedirs(os.path.dirname(ncfile))
+    radflux_synth.write_ceres_nc(ncfile, nmonths)
+    radflux_synth.write_ceres_h5(ncfile[:-len('.nc')] + '.h5', nmonths)
+    radflux_synth.write_coastlines(os.path.join(data, 'ceres', 'coastlines.mat'))
+    with open(stamp, 'w') as f:
+        json.dump(params, f)
+    print 'done in %.1f s' % (timer.time() - t0)
+
+
+def report(results, baseline, header=True):
+
+    if header:
+        print '%-22s %10s %10s %7s %10s %10s' % ('benchmark', 'time (s)', 'baseline', 'ratio', 'peak (MB)', 'baseline')
+    for name, result in results:
+        if 'time' not in result:
+            reason = result.get('skipped') or result.get('failed')
+            print '%-22s %s' % (name, ('skipped: %s' % reason) if 'skipped' in result else ('failed: %s' % reason))
+            continue
+        base = baseline.get(name, {})
+        if 'time' in base:
+            print '%-22s %10.4f %10.4f %6.2fx %10.1f %10.1f' % (name, result['time'], base['time'], result['time'] / base['time'],
+                                                                 result['memory'], base['memory'])
+        else:
+            print '%-22s %10.4f %10s %7s %10.1f %10s' % (name, result['time'], '-', '-', result['memory'], '-')
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='radflux benchmarks on synthetic data')
+    parser.add_argument('benchmarks', nargs='*', help='benchmarks to run (default: all), among ' + ', '.join([b[0] for b in BENCHMARKS]))
+    parser.add_argument('--data', default=os.path.join('bench', 'data'), help='synthetic data directory')
+    parser.add_argument('--days', type=int, default=366, help='number of 1-min station days')
+    parser.add_argument('--months', type=int, default=120, help='number of CERES months')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default='bench_baseline.json', help='stored baseline')
+    parser.add_argument('--save', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--check', action='store_true', help='only run the accuracy checks, exits with 1 if one fails')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(1 if run_checks() > 0 else 0)
+
+    data = os.path.abspath(args.data)
+    if args.child is not None:
+        print json.dumps(run_one(args.child, data, args.repeat))
+        return
+
+    names = args.benchmarks or [b[0] for b in BENCHMARKS]
+    unknown = [name for name in names if name not in [b[0] for b in BENCHMARKS]]
+    if len(unknown) > 0:
+        parser.error('unknown benchmarks: ' + ', '.join(unknown))
+
+    ensure_data(data, args.days, args.months)
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = []
+    for name in names:
+        results.append((name, run_child(name, data, args.repeat)))
+        report(results[-1:], baseline, header=False)
+    print
+    report(results, baseline)
+
+    if args.save:
+        for name, result in results:
+            if 'time' in result:
+                baseline[name] = result
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print 'baseline stored in ', args.baseline
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_aggregate.py
+
+Daily means, monthly means and mean diurnal cycles of each month, over epoch
+time series of any length (e.g. years of 1-min station data).
+
+Group keys are computed from the epoch times with integer calendar arithmetic
+(days since epoch, and the inverse of the day count in epoch_from_fields for
+months). Each variable is then reduced in one pass with two np.bincount: the
+sum of its finite values and their number per group. There is no Python
+loop over groups.
+
+Each mean comes with a coverage fraction: the number of finite samples in the
+group divided by the number expected at the sampling interval of the series.
+"""
+
+import numpy as np
+
+from radflux_utils import epoch_from_fields
+
+
+RESOLUTIONS = ('daily', 'monthly', 'diurnal')
+
+
+def civil_from_days(days):
+    '''
+    year, month, day of integer day counts since 1970-01-01
+    (proleptic gregorian calendar)
+    '''
+
+    # years start in March, like in epoch_from_fields
+    z = np.asarray(days, dtype=np.int64) + 719468
+    era = np.floor_divide(z, 146097)
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    year = yoe + era * 400 + (month <= 2)
+    return year, month, day
+
+
+def group_index(time, resolution, nbins=24):
+    '''
+    group of each sample for a resolution among RESOLUTIONS.
+    returns the group index of the samples (0 to ngroups-1), and the start,
+    length and display time of the groups in seconds.
+    Diurnal groups are (month, time of day bin) with nbins bins a day, their
+    length is the time the bin covers in the month and they are displayed
+    stretched over their month, the cycle of a month following its bins.
+    '''
+
+    if resolution not in RESOLUTIONS:
+        raise ValueError('Unknown resolution: %s' % resolution)
+
+    days = np.floor_divide(np.asarray(time, dtype=np.float64), 86400.).astype(np.int64)
+    if resolution == 'daily':
+        first = days.min()
+        ngroups = days.max() - first + 1
+        start = (first + np.arange(ngroups)) * 86400.
+        length = np.zeros(ngroups) + 86400.
+        return days - first, start, length, start + 43200.
+
+    year, month, day = civil_from_days(days)
+    months = year * 12 + month - 1
+    first = months.min()
+    nmonths = months.max() - first + 1
+    # start and length of the months, from their year and month
+    gmonths = first + np.arange(nmonths + 1)
+    mstart, valid = epoch_from_fields(gmonths // 12, gmonths % 12 + 1, 1)
+    mlength = np.diff(mstart)
+    mstart = mstart[:-1]
+    if resolution == 'monthly':
+        return months - first, mstart, mlength, mstart + 0.5 * mlength
+
+    binsize = 86400. / nbins
+    bins = ((time - days * 86400.) // binsize).astype(np.int64)
+    bins = np.clip(bins, 0, nbins - 1)
+    position = np.arange(nbins)
+    start = (mstart[:,np.newaxis] + position * binsize).ravel()
+    length = (mlength[:,np.newaxis] / nbins + np.zeros(nbins)).ravel()
+    display = (mstart[:,np.newaxis] + mlength[:,np.newaxis] * (position + 0.5) / nbins).ravel()
+    return (months - first) * nbins + bins, start, length, display
+
+
+def aggregate(time, values, resolution, nbins=24, interval=None):
+    '''
+    means of the finite values of each series in the values dict per group
+    (see group_index), for the groups holding at least one sample.
+    interval is the sampling interval in seconds, by default the median time step.
+    returns a dict with
+        time      display times of the groups
+        start     group starts
+        length    group lengths in seconds
+        count     number of samples in each group
+        means     {name: mean per group, NaN without any finite value}
+        coverage  {name: fraction of the expected samples with a finite value}
+    '''
+
+    time = np.asarray(time, dtype=np.float64)
+    keys, start, length, display = group_index(time, resolution, nbins)
+    ngroups = len(start)
+    count = np.bincount(keys, minlength=ngroups)
+    kept = count > 0
+
+    if interval is None:
+        interval = np.median(np.diff(time)) if len(time) > 1 else 1.
+    expected = length[kept] / interval
+
+    means = {}
+    coverage = {}
+    for name in values:
+        x = np.asarray(values[name])
+        finite = np.isfinite(x)
+        sums = np.bincount(keys, weights=np.where(finite, x, 0.), minlength=ngroups)[kept]
+        counts = np.bincount(keys, weights=finite, minlength=ngroups)[kept]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[name] = np.where(counts > 0, sums / counts, np.nan)
+        coverage[name] = np.minimum(counts / expected, 1.)
+
+    return {'time': display[kept], 'start': start[kept], 'length': length[kept], 'count': count[kept],
+            'means': means, 'coverage': coverage}
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_align.py
+
+Joins a time series onto another time axis by timestamp, e.g. meteo
+temperature and humidity onto the radflux samples.
+Sample lookup is a single vectorized searchsorted, so multi-year 1-min
+joins stay fast. Target samples farther than max_gap from the source data
+get NaN.
+"""
+
+import numpy as np
+
+
+def align(src_time, values, time, method='nearest', max_gap=None):
+    '''
+    samples values, given on the sorted src_time axis, on the time axis.
+    values is an array or a dict of arrays, the result has the same form.
+    method is 'nearest' or 'linear'.
+    max_gap (seconds) is the largest distance to the nearest source sample
+    for 'nearest', or between the two bracketing samples for 'linear'.
+    It defaults to 1.5 times the median source sampling step.
+    '''
+
+    src_time = np.asarray(src_time, dtype=np.float64)
+    time = np.asarray(time, dtype=np.float64)
+    single = not isinstance(values, dict)
+    if single:
+        values = {None: values}
+
+    n = len(src_time)
+    if n < 1:
+        result = dict([(name, np.zeros(len(time)) + np.nan) for name in values])
+        return result[None] if single else result
+
+    if max_gap is None:
+        max_gap = 1.5 * np.median(np.diff(src_time)) if n > 1 else 0.
+
+    right = np.clip(np.searchsorted(src_time, time), 0, n - 1)
+    left = np.clip(right - 1, 0, n - 1)
+
+    if method == 'nearest':
+        dleft = np.abs(time - src_time[left])
+        dright = np.abs(src_time[right] - time)
+        idx = np.where(dleft <= dright, left, right)
+        bad = np.minimum(dleft, dright) > max_gap
+        result = {}
+        for name in values:
+            v = np.asarray(values[name])[idx]
+            if v.dtype.kind != 'f':
+                v = v.astype(np.float64)
+            v[bad] = np.nan
+            result[name] = v
+    elif method == 'linear':
+        # exact hits are taken as is, other samples need a bracket on each side
+        exact = src_time[right] == time
+        left = np.where(exact, right, left)
+        span = src_time[right] - src_time[left]
+        inside = (src_time[left] <= time) & (time <= src_time[right])
+        bad = ~inside | (span > max_gap)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.where(span > 0, (time - src_time[left]) / span, 0.)
+        result = {}
+        for name in values:
+            v = np.asarray(values[name])
+            dtype = v.dtype if v.dtype.kind == 'f' else np.float64
+            v = (v[left] * (1 - w) + v[right] * w).astype(dtype, copy=False)
+            v[bad] = np.nan
+            result[name] = v
+    else:
+        raise ValueError('Unknown alignment method: %s' % method)
+
+    return result[None] if single else result
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_api.py
+
+GUI-free entry point to the radflux computations: station and CERES readers,
+clear-sky models and solar geometry, alignment, aggregation, derived fields,
+reductions, display decimation, coastlines, file following and profiling.
+
+Importing it only loads numpy and the standard library. netCDF4, h5py and
+scipy are imported on first use by the readers that need them, and nothing
+here touches chaco, traits, pyface or reportlab, so batch workers start fast.
+"""
+
+from radflux_utils import radflux_read, radflux_year_read, meteo_read, meteo_year_read, solar_year_read
+from radflux_utils import read_1a_file, read_table_file, epoch_from_fields, set_float32, storage
+from radflux_utils import find_meteo_file
+from radflux_utils import CeresDataset, ceres_nc_read, ceres_read, coastlines_read
+from radflux_utils import clearsky_batch, sw_clearsky, lw_clearsky, sw_clearsky_time
+from radflux_solar import solar_zenith_angle
+from radflux_align import align
+from radflux_catalog import get_catalog
+from radflux_series import load_station_series, find_station_files, to_epoch, add_clearsky
+from radflux_derived import DerivedFields, CERES_FORMULAS, parse_formula, color_range, map_title
+from radflux_reductions import Reductions
+from radflux_climatology import Climatology, load_climatology, climatology_file
+from radflux_lod import Envelope
+from radflux_aggregate import aggregate, group_index
+from radflux_coastlines import Coastlines, load_coastlines
+from radflux_follow import FollowReader, GrowableArray
+from radflux_profile import stage, profiled, set_profiling, summary, report
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
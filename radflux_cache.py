@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_cache.py
+
+Persistent binary cache for the parsed SIRTA ASCII files.
+
+The first time a text file goes through a cached reader, the arrays it
+returns are stored as .npy files in a cache directory. Later reads of the same
+file memory-map those arrays instead of parsing text again.
+Entries are keyed on the file path, size, mtime and the reader version, so a
+modified file or a reader change never hits a stale entry.
+The cache size is capped, least recently used entries are evicted first.
+
+Settings can be given through the environment:
+    RADFLUX_CACHE_DIR      cache directory (default ~/.cache/radflux)
+    RADFLUX_CACHE_SIZE_MB  size cap in MB (default 512)
+    RADFLUX_CACHE          set to 0 to disable the cache
+or with set_cache_dir, set_cache_size and set_cache_enabled.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import functools
+
+import numpy as np
+
+
+settings = {
+    'dir': os.environ.get('RADFLUX_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'radflux')),
+    'max_size': int(float(os.environ.get('RADFLUX_CACHE_SIZE_MB', 512)) * 1024 * 1024),
+    'enabled': os.environ.get('RADFLUX_CACHE', '1') != '0',
+}
+
+MANIFEST = 'manifest.json'
+
+
+def set_cache_dir(path):
+    settings['dir'] = path
+
+
+def set_cache_size(max_size):
+    '''
+    cache size cap in bytes
+    '''
+    settings['max_size'] = int(max_size)
+    evict()
+
+
+def set_cache_enabled(enabled):
+    settings['enabled'] = bool(enabled)
+
+
+def cache_key(filename, version, extra=''):
+
+    st = os.stat(filename)
+    key = '%s|%d|%r|%s|%s' % (os.path.abspath(filename), st.st_size, st.st_mtime, version, extra)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _entries():
+
+    cachedir = settings['dir']
+    if not os.path.isdir(cachedir):
+        return []
+    entries = []
+    for name in os.listdir(cachedir):
+        entry = os.path.join(cachedir, name)
+        if os.path.isfile(os.path.join(entry, MANIFEST)):
+            entries.append(entry)
+    return entries
+
+
+def _entry_size(entry):
+
+    size = 0
+    for name in os.listdir(entry):
+        size += os.path.getsize(os.path.join(entry, name))
+    return size
+
+
+def load(key):
+    '''
+    returns the cached arrays for key, memory-mapped copy-on-write,
+    or None if there is no such entry.
+    '''
+
+    entry = os.path.join(settings['dir'], key)
+    try:
+        with open(os.path.join(entry, MANIFEST)) as f:
+            manifest = json.load(f)
+        arrays = [np.load(os.path.join(entry, name), mmap_mode='c') for name in manifest['arrays']]
+        # the entry directory mtime is the LRU clock
+        os.utime(entry, None)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+    if manifest['tuple']:
+        return tuple(arrays)
+    return arrays[0]
+
+
+def store(key, result, source=''):
+
+    cachedir = settings['dir']
+    if not os.path.isdir(cachedir):
+        try:
+            os.makedirs(cachedir)
+        except OSError:
+            if not os.path.isdir(cachedir):
+                raise
+
+    is_tuple = isinstance(result, tuple)
+    arrays = result if is_tuple else (result,)
+
+    # write in a private directory then rename, so that concurrent readers
+    # on a shared node never see a half-written entry
+    tmpdir = tempfile.mkdtemp(prefix='.tmp-', dir=cachedir)
+    names = []
+    for i, a in enumerate(arrays):
+        name = 'arr_%d.npy' % i
+        np.save(os.path.join(tmpdir, name), np.asarray(a))
+        names.append(name)
+    with open(os.path.join(tmpdir, MANIFEST), 'w') as f:
+        json.dump({'arrays': names, 'tuple': is_tuple, 'source': os.path.abspath(source)}, f)
+
+    try:
+        os.rename(tmpdir, os.path.join(cachedir, key))
+    except OSError:
+        # another process stored the same entry first
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    evict()
+
+
+def evict():
+    '''
+    removes least recently used entries until the cache fits in its size cap
+    '''
+
+    entries = []
+    total = 0
+    for entry in _entries():
+        try:
+            size = _entry_size(entry)
+            entries.append((os.path.getmtime(entry), size, entry))
+        except OSError:
+            continue
+        total += size
+
+    entries.sort()
+    for atime, size, entry in entries:
+        if total <= settings['max_size']:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def invalidate(filename):
+    '''
+    removes every entry built from filename
+    '''
+
+    source = os.path.abspath(filename)
+    for entry in _entries():
+        try:
+            with open(os.path.join(entry, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            continue
+        if manifest.get('source') == source:
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def clear():
+
+    for entry in _entries():
+        shutil.rmtree(entry, ignore_errors=True)
+
+
+def cached_reader(version):
+    '''
+    decorator for readers of the form reader(filename, *args) returning an
+    array or a tuple of arrays. version needs to be bumped whenever the
+    reader output changes, so that older entries are not used anymore.
+    '''
+
+    def decorator(reader):
+
+        @functools.wraps(reader)
+        def wrapper(filename, *args):
+
+            if not settings['enabled']:
+                return reader(filename, *args)
+
+            key = cache_key(filename, '%s-%s' % (reader.__name__, version), repr(args))
+            result = load(key)
+            if result is None:
+                result = reader(filename, *args)
+                try:
+                    store(key, result, source=filename)
+                except (IOError, OSError):
+                    # a read-only or full cache should not prevent reading data
+                    pass
+            return result
+
+        wrapper.uncached = reader
+        return wrapper
+
+    return decorator
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
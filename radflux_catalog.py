@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_catalog.py
+
+Catalog of the files under a data root.
+The root is scanned once and every radflux, meteo, solar angle, CERES and
+coastline file is recorded with its type, version and covered time span in a
+SQLite index (.radflux_catalog.sqlite in the data root, or in the cache
+directory when the root is read-only).
+Later scans only list the directories whose mtime changed.
+Lookups of the files covering [t0, t1] go through an index on (kind, start).
+get_catalog refreshes a catalog at most every REFRESH_DELAY seconds, and a
+lookup finding nothing rescans first, so new files are found right away.
+
+kinds are radflux_day, radflux_year, meteo_day, meteo_year, solar, ceres and
+coastlines. Times are epoch seconds, solar and coastlines files have no span.
+"""
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import calendar
+
+import radflux_cache
+
+
+DBNAME = '.radflux_catalog.sqlite'
+
+# seconds between two automatic refreshes of the same catalog,
+# a lookup that finds nothing always rescans
+REFRESH_DELAY = 10.
+
+
+def _epoch(year, month=1, day=1):
+
+    return float(calendar.timegm((year, month, day, 0, 0, 0)))
+
+
+def _next_month(year, month):
+
+    if month == 12:
+        return year + 1, 1
+    return year, month + 1
+
+
+def _header_version(filename):
+
+    # the yearly files give their version in the header, e.g. '# Version : 1'
+    with open(filename, 'rb') as f:
+        for i in range(10):
+            line = f.readline()
+            if not line.startswith(b'#'):
+                break
+            if b'Version' in line:
+                return line.split(b':')[-1].strip().decode('latin-1')
+    return ''
+
+
+def _day_span(match):
+
+    day = match.group('date')
+    start = _epoch(int(day[:4]), int(day[4:6]), int(day[6:]))
+    return start, start + 86400.
+
+
+def _year_span(match):
+
+    year = int(match.group('year'))
+    return _epoch(year), _epoch(year + 1)
+
+
+def _ceres_span(match):
+
+    y0, m0 = int(match.group('start')[:4]), int(match.group('start')[4:])
+    y1, m1 = _next_month(int(match.group('end')[:4]), int(match.group('end')[4:]))
+    return _epoch(y0, m0), _epoch(y1, m1)
+
+
+def _no_span(match):
+
+    return None, None
+
+
+# kind, filename pattern, span from the filename match, version from the match or the file
+patterns = [
+    ('radflux_day', re.compile(r'^radflux_1a_\w+_v(?P<version>\d+)_(?P<date>\d{8})_\d{6}_\d+\.txt$'), _day_span, None),
+    ('meteo_day', re.compile(r'^meteoz1_1a_\w+_v(?P<version>\d+)_(?P<date>\d{8})_\d{6}_\d+\.asc$'), _day_span, None),
+    ('radflux_year', re.compile(r'^radflux_(?P<year>\d{4})\.txt$'), _year_span, _header_version),
+    ('meteo_year', re.compile(r'^MeteoZ1_SIRTA_Z1_1hour(?P<year>\d{4})\.txt$'), _year_span, _header_version),
+    ('solar', re.compile(r'^solar_angle_SIRTA_year\.txt$'), _no_span, None),
+    ('coastlines', re.compile(r'^coastlines\.mat$'), _no_span, None),
+    ('ceres', re.compile(r'^CERES_EBAF.*_(?P<version>Ed[\d.]+\w*)_.*(?P<start>\d{6})-(?P<end>\d{6})\.nc$'), _ceres_span, None),
+]
+
+
+def identify(filename):
+    '''
+    returns (kind, version, start, end) for a data file, None if the file is not known
+    '''
+
+    basename = os.path.basename(filename)
+    for kind, pattern, span, version_reader in patterns:
+        match = pattern.match(basename)
+        if match is None:
+            continue
+        start, end = span(match)
+        if version_reader is not None:
+            version = version_reader(filename)
+        else:
+            version = match.groupdict().get('version') or ''
+        return kind, version, start, end
+    return None
+
+
+class Catalog(object):
+
+    def __init__(self, root, dbfile=None):
+
+        self.root = os.path.abspath(root)
+        if dbfile is None:
+            dbfile = self.default_dbfile()
+        self.dbfile = dbfile
+        self.db = sqlite3.connect(dbfile, timeout=30)
+        self.db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dir TEXT, kind TEXT, version TEXT, '
+                        'start REAL, end REAL, mtime REAL, size INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS files_kind_start ON files (kind, start)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime REAL)')
+        self.db.commit()
+        self.last_refresh = None
+        self.max_span = {}
+
+    def default_dbfile(self):
+
+        if os.access(self.root, os.W_OK):
+            return os.path.join(self.root, DBNAME)
+        cachedir = radflux_cache.settings['dir']
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        key = hashlib.sha1(self.root.encode('utf-8')).hexdigest()
+        return os.path.join(cachedir, 'catalog-%s.sqlite' % key)
+
+    def refresh(self):
+        '''
+        rescans the directories whose mtime changed since the last scan
+        '''
+
+        known = dict(self.db.execute('SELECT path, mtime FROM dirs'))
+        seen = set()
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            seen.add(dirpath)
+            mtime = os.path.getmtime(dirpath)
+            if known.get(dirpath) == mtime:
+                continue
+            self._scan_dir(dirpath, filenames)
+            self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?)', (dirpath, mtime))
+
+        for dirpath in set(known) - seen:
+            self.db.execute('DELETE FROM files WHERE dir = ?', (dirpath,))
+            self.db.execute('DELETE FROM dirs WHERE path = ?', (dirpath,))
+        self.db.commit()
+
+        self.max_span = dict(self.db.execute('SELECT kind, MAX(end - start) FROM files GROUP BY kind'))
+        self.last_refresh = time.time()
+
+    def _scan_dir(self, dirpath, filenames):
+
+        stored = dict([(row[0], (row[1], row[2])) for row in
+                       self.db.execute('SELECT path, mtime, size FROM files WHERE dir = ?', (dirpath,))])
+        present = set()
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if stored.get(path) == (st.st_mtime, st.st_size):
+                present.add(path)
+                continue
+            info = identify(path)
+            if info is None:
+                continue
+            present.add(path)
+            kind, version, start, end = info
+            self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (path, dirpath, kind, version, start, end, st.st_mtime, st.st_size))
+        for path in set(stored) - present:
+            self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def find(self, kind, t0=None, t1=None, rescan=True):
+        '''
+        returns the (start, end, path) of the files of a kind overlapping [t0, t1],
+        sorted by start time. Without t0 and t1, returns every file of that kind.
+        When nothing matches, the root is rescanned first (unless rescan is
+        False), so that files written since the last refresh are found.
+        '''
+
+        rows = self._find(kind, t0, t1)
+        if len(rows) < 1 and rescan:
+            self.refresh()
+            rows = self._find(kind, t0, t1)
+        return rows
+
+    def _find(self, kind, t0, t1):
+
+        if t0 is None or t1 is None:
+            rows = self.db.execute('SELECT start, end, path FROM files WHERE kind = ? ORDER BY start, path', (kind,))
+            return list(rows)
+
+        # files start at most max_span before t0, which bounds the index range scan
+        span = self.max_span.get(kind) or 0.
+        rows = self.db.execute('SELECT start, end, path FROM files WHERE kind = ? AND start >= ? AND start <= ? '
+                               'AND end > ? ORDER BY start, path', (kind, t0 - span, t1, t0))
+        return list(rows)
+
+    def find_one(self, kind, t=None):
+        '''
+        returns the path of a file of this kind covering time t, None if there is none.
+        '''
+
+        if t is None:
+            files = self.find(kind)
+        else:
+            files = self.find(kind, t, t)
+        if len(files) < 1:
+            return None
+        return files[0][2]
+
+
+catalogs = {}
+
+
+def get_catalog(root):
+    '''
+    returns the refreshed catalog of a data root, shared within a process
+    '''
+
+    key = (os.path.abspath(root), os.getpid())
+    catalog = catalogs.get(key)
+    if catalog is None:
+        catalog = Catalog(root)
+        catalogs[key] = catalog
+    if catalog.last_refresh is None or (time.time() - catalog.last_refresh) > REFRESH_DELAY:
+        catalog.refresh()
+    return catalog
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_climatology.py
+
+Multi-year monthly climatology of the CERES base fields, and anomalies of
+any window against it.
+
+The climatology is computed in a single chunked pass over the time axis per
+base field, accumulating sums and valid-month counts for each calendar
+month, so the cube is never held in memory. Base fields are processed in
+parallel worker processes, each with its own handle on the NetCDF file.
+The result is stored next to the source file (<file>.climatology.npz, or in
+the radflux cache directory if that is not writable) and reused as long as
+the source file does not change.
+"""
+
+import os
+import hashlib
+import multiprocessing
+
+import numpy as np
+
+import radflux_cache
+from radflux_utils import CeresDataset
+
+
+VERSION = 1
+
+
+def climatology_sums(args):
+    '''
+    sums and valid-month counts of a base field for each calendar month,
+    as (12, lat, lon) arrays
+    '''
+
+    ceresfile, base, chunk = args
+    ds = CeresDataset(ceresfile)
+    months = ds.month
+    sums = np.zeros((12,) + tuple(ds.shape[1:]))
+    counts = np.zeros((12,) + tuple(ds.shape[1:]), dtype=np.int32)
+    for t in range(0, ds.shape[0], chunk):
+        tend = min(t + chunk, ds.shape[0])
+        window = ds.read(base, t, tend)
+        valid = np.isfinite(window)
+        values = np.where(valid, window, 0)
+        for i in range(tend - t):
+            m = months[t + i] - 1
+            sums[m] += values[i]
+            counts[m] += valid[i]
+    ds.close()
+    return sums, counts
+
+
+class Climatology(object):
+
+    def __init__(self, sums, counts):
+        '''
+        sums and counts are dicts {base: (12, lat, lon) array}
+        '''
+
+        self.sums = sums
+        self.counts = counts
+        self.means = {}
+        for base in sums:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self.means[base] = np.where(counts[base] > 0, sums[base] / counts[base], np.nan)
+
+    def window_mean(self, coefs, months):
+        '''
+        climatological mean of a linear combination {base: coefficient}
+        of base fields, over a window covering the given calendar months (1-12)
+        '''
+
+        # a month appearing twice in the window counts twice
+        months = np.asarray(months)
+        weights = np.bincount(months - 1, minlength=12) / float(len(months))
+        used = np.flatnonzero(weights)
+        result = None
+        for base in sorted(coefs):
+            # months without data at a pixel are skipped, NaN if all are
+            means = self.means[base][used]
+            valid = np.isfinite(means)
+            total = np.tensordot(weights[used], np.where(valid, means, 0), axes=1)
+            # the weights of the valid months sum to 1 again
+            norm = np.tensordot(weights[used], valid, axes=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                term = np.where(norm > 0, total / norm, np.nan) * coefs[base]
+            result = term if result is None else result + term
+        return result
+
+
+def climatology_file(ceresfile):
+
+    sidecar = ceresfile + '.climatology.npz'
+    if os.access(os.path.dirname(os.path.abspath(ceresfile)), os.W_OK):
+        return sidecar
+    key = hashlib.sha1(os.path.abspath(ceresfile).encode('utf-8')).hexdigest()
+    return os.path.join(radflux_cache.settings['dir'], 'climatology-%s.npz' % key)
+
+
+def _source_id(ceresfile):
+
+    st = os.stat(ceresfile)
+    return np.array([VERSION, st.st_size, st.st_mtime])
+
+
+def compute_climatology(ceresfile, bases, chunk=12, processes=None):
+
+    jobs = [(ceresfile, base, chunk) for base in bases]
+    if processes == 1 or len(jobs) == 1:
+        results = [climatology_sums(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes or min(len(jobs), multiprocessing.cpu_count()))
+        try:
+            results = pool.map(climatology_sums, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    sums = dict([(base, r[0]) for (base, r) in zip(bases, results)])
+    counts = dict([(base, r[1]) for (base, r) in zip(bases, results)])
+    return Climatology(sums, counts)
+
+
+def load_climatology(ceresfile, bases, chunk=12, processes=None):
+    '''
+    returns the Climatology of the base fields of ceresfile, from the stored
+    file if it is up to date, computing and storing it otherwise
+    '''
+
+    bases = sorted(bases)
+    filename = climatology_file(ceresfile)
+    source = _source_id(ceresfile)
+    if os.path.isfile(filename):
+        try:
+            stored = np.load(filename)
+            if np.array_equal(stored['source'], source) and all(['sums_' + b in stored.files for b in bases]):
+                sums = dict([(b, stored['sums_' + b]) for b in bases])
+                counts = dict([(b, stored['counts_' + b]) for b in bases])
+                return Climatology(sums, counts)
+        except (IOError, ValueError, KeyError):
+            pass
+
+    clim = compute_climatology(ceresfile, bases, chunk=chunk, processes=processes)
+    arrays = {'source': source}
+    for b in bases:
+        arrays['sums_' + b] = clim.sums[b]
+        arrays['counts_' + b] = clim.counts[b]
+    try:
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        np.savez(filename, **arrays)
+    except (IOError, OSError):
+        print 'Could not store climatology in ', filename
+    return clim
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_coastlines.py
+
+Coastlines for the rfspace maps, as polylines at several levels of detail.
+
+coastlines.mat holds the vertices of all the coastlines in one (n, 2)
+lon, lat array, with NaN rows between polylines. The file is split into
+polylines at those rows (and where a line jumps across the date line), and
+each polyline is simplified with the Douglas-Peucker algorithm for a few
+tolerances. This runs once per file: the levels go to the radflux cache.
+
+A map shows the coarsest level whose tolerance stays under a pixel, as
+NaN-separated lon, lat arrays for a line plot.
+"""
+
+import numpy as np
+
+from radflux_cache import cached_reader
+from radflux_catalog import get_catalog
+
+
+# simplification tolerances of the levels, in degrees
+TOLERANCES = (0., 0.05, 0.1, 0.25, 0.5, 1.)
+
+
+def split_polylines(lon, lat):
+    '''
+    list of (n, 2) arrays of the polylines in NaN-separated lon, lat arrays
+    '''
+
+    points = np.column_stack([np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)])
+    valid = np.isfinite(points).all(axis=1)
+    # breaks at separators, and between vertices on each side of the date line
+    breaks = np.zeros(len(points) + 1, dtype=bool)
+    breaks[0] = breaks[-1] = True
+    breaks[1:-1] = ~valid[1:] | ~valid[:-1]
+    with np.errstate(invalid='ignore'):
+        breaks[1:-1] |= np.abs(np.diff(points[:,0])) > 180.
+    edges = np.flatnonzero(breaks)
+
+    polylines = []
+    for i, j in zip(edges[:-1], edges[1:]):
+        line = points[i:j][valid[i:j]]
+        if len(line) > 1:
+            polylines.append(line)
+    return polylines
+
+
+def simplify(points, tolerance):
+    '''
+    Douglas-Peucker simplification of a polyline, keeping its end points
+    '''
+
+    n = len(points)
+    if tolerance <= 0 or n < 3:
+        return points
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while len(stack) > 0:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+        a = points[i]
+        d = points[j] - a
+        inner = points[i+1:j] - a
+        norm = np.hypot(d[0], d[1])
+        if norm == 0:
+            # closed polyline, distance to the end point
+            dist = np.hypot(inner[:,0], inner[:,1])
+        else:
+            dist = np.abs(d[0] * inner[:,1] - d[1] * inner[:,0]) / norm
+        k = np.argmax(dist)
+        if dist[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return points[keep]
+
+
+def join_polylines(polylines):
+    '''
+    NaN-separated lon, lat arrays of a list of polylines
+    '''
+
+    if len(polylines) < 1:
+        return np.zeros(0), np.zeros(0)
+    separator = np.zeros((1, 2)) + np.nan
+    parts = []
+    for line in polylines:
+        parts.append(line)
+        parts.append(separator)
+    points = np.concatenate(parts[:-1])
+    return points[:,0].copy(), points[:,1].copy()
+
+
+@cached_reader(1)
+def read_coastline_levels(filename, tolerances=TOLERANCES):
+    '''
+    returns (lon0, lat0, lon1, lat1...), the NaN-separated coastlines
+    simplified for each tolerance
+    '''
+
+    from scipy.io import matlab
+
+    coastlines = matlab.loadmat(filename)['tmp']
+    polylines = split_polylines(coastlines[:,0], coastlines[:,1])
+    arrays = []
+    for tolerance in tolerances:
+        lon, lat = join_polylines([simplify(line, tolerance) for line in polylines])
+        arrays.extend([lon, lat])
+    return tuple(arrays)
+
+
+class Coastlines(object):
+
+    def __init__(self, filename, tolerances=TOLERANCES):
+
+        arrays = read_coastline_levels(filename, tuple(tolerances))
+        self.tolerances = list(tolerances)
+        self.levels = [(arrays[2*i], arrays[2*i+1]) for i in range(len(tolerances))]
+
+    def level(self, extent, npixels):
+        '''
+        index of the coarsest level with a tolerance under the size of a
+        pixel, for a map extent (degrees) drawn on npixels
+        '''
+
+        pixel = float(extent) / max(npixels, 1)
+        level = 0
+        for i, tolerance in enumerate(self.tolerances):
+            if tolerance <= pixel:
+                level = i
+        return level
+
+    def lines(self, extent, npixels):
+        '''
+        NaN-separated lon, lat arrays of the coastlines for a map extent
+        (degrees of longitude) drawn on npixels
+        '''
+
+        return self.levels[self.level(extent, npixels)]
+
+
+def load_coastlines(path):
+    '''
+    Coastlines of the coastline file in a data directory
+    '''
+
+    coastfile = get_catalog(path).find_one('coastlines')
+    if coastfile is None:
+        coastfile = path + '/coastlines.mat'
+    return Coastlines(coastfile)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_derived.py
+
+On-demand derived variables over the CERES base fields (swup, lwup, swupclr,
+lwupclr).
+
+Derived variables are declared as linear formulas of the base fields, e.g.
+'swupclr - swup' or '0.5 * swup + 0.5 * lwup'. Since the time mean is linear,
+the mean of a derived variable over a window is the same combination of the
+window means of its base fields: only the 2-D means of the base fields are
+computed, one chunk of months at a time, and no derived cube is ever built.
+Results are cached per (variable, window).
+
+The identity holds exactly for gap-free fields like EBAF. Where a base field
+has missing (NaN) months at a pixel, each base mean uses its own valid months.
+Means are NaN where no month is valid.
+
+Once build_prefix_sums has run, base window means come from cumulative sums
+along time (and cumulative valid-month counts if the field has missing
+values), so any contiguous window mean is the difference of two slices.
+"""
+
+import re
+
+import numpy as np
+
+from radflux_utils import storage
+
+
+# the variables shown by rfspace, as formulas over the CERES base fields
+CERES_FORMULAS = {
+    'Shortwave Upgoing Radiation Flux (measurements)': 'swup',
+    'Shortwave Clear-Sky Upgoing Radiation Flux (model)': 'swupclr',
+    'Shortwave, model - measurements': 'swupclr - swup',
+    'Longwave Upgoing Radiation Flux (measurements)': 'lwup',
+    'Longwave Clear-Sky Upgoing Radiation Flux (model)': 'lwupclr',
+    'Longwave, model - measurements': 'lwupclr - lwup',
+    'Cloud Radiative Impact (LW difference + SW difference)': 'swupclr - swup + lwupclr - lwup',
+}
+
+
+
+def color_range(selector, anomaly=False):
+    '''
+    (min, max) of the colour scale of the rfspace maps of a variable, in W/m2
+    '''
+
+    if anomaly:
+        return -30, 30
+    elif 'model - measurements' in selector:
+        return -80, 80
+    elif selector.startswith('Shortwave'):
+        return 0, 250
+    elif selector.startswith('Longwave'):
+        return 0, 400
+    return -50, 50
+
+
+def map_title(statistic, nmonth, year, month_start, years):
+
+    if statistic == 'Mean':
+        return 'CERES RF DATA %d months average since %04d-%02d-01' % (nmonth, year, month_start)
+    elif statistic == 'Climatology':
+        return 'CERES RF DATA %d months climatology from month %02d, %d-%d' % (nmonth, month_start, years[0], years[-1])
+    return 'CERES RF DATA %d months anomaly since %04d-%02d-01' % (nmonth, year, month_start)
+
+
+term_pattern = re.compile(r'\s*([+-]?)\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?)\s*\*\s*)?([A-Za-z_]\w*)\s*')
+
+
+def parse_formula(formula):
+    '''
+    parses a linear formula like 'swupclr - swup + 2 * lwup'
+    returns a dict {base field: coefficient}
+    '''
+
+    coefs = {}
+    pos = 0
+    formula = formula.strip()
+    while pos < len(formula):
+        match = term_pattern.match(formula, pos)
+        if match is None or match.end() == pos:
+            raise ValueError('Invalid formula: %s' % formula)
+        sign, coef, name = match.groups()
+        if pos > 0 and sign == '':
+            raise ValueError('Missing operator in formula: %s' % formula)
+        coef = float(coef) if coef else 1.
+        if sign == '-':
+            coef = -coef
+        coefs[name] = coefs.get(name, 0.) + coef
+        pos = match.end()
+    if len(coefs) < 1:
+        raise ValueError('Empty formula')
+    return coefs
+
+
+class DerivedFields(object):
+
+    '''
+    window means of base and derived variables over a dataset providing
+    read(name, tstart, tend) for its base fields (e.g. CeresDataset)
+    '''
+
+    def __init__(self, dataset, formulas=None, chunk=12, cache_size=64):
+
+        self.dataset = dataset
+        self.chunk = chunk
+        self.cache_size = cache_size
+        self.formulas = {}
+        self.sums = {}
+        self.counts = {}
+        self.cache = {}
+        self.cache_order = []
+        if formulas is not None:
+            for name in formulas:
+                self.define(name, formulas[name])
+
+    def define(self, name, formula):
+
+        self.formulas[name] = parse_formula(formula)
+        # an existing name might have changed meaning
+        for key in [k for k in self.cache if k[0] == name]:
+            del self.cache[key]
+            self.cache_order.remove(key)
+
+    def clear_cache(self):
+        '''
+        forgets the cached window means, the prefix sums are kept
+        '''
+
+        self.cache = {}
+        self.cache_order = []
+
+    def _cached(self, key, compute):
+
+        if key in self.cache:
+            self.cache_order.remove(key)
+            self.cache_order.append(key)
+            return self.cache[key]
+        value = compute()
+        self.cache[key] = value
+        self.cache_order.append(key)
+        while len(self.cache_order) > self.cache_size:
+            del self.cache[self.cache_order.pop(0)]
+        return value
+
+    def build_prefix_sums(self, bases=None):
+        '''
+        cumulative sums along time of the base fields, read chunk by chunk.
+        sums[base][t] is the sum of months [0, t), counts[base] the matching
+        number of valid months, None when the field has no missing value.
+        Sums have the storage float type. A window sum is S[t1] - S[t0]: the
+        rounding done before t0 is common to both terms, but each addition in
+        the window is rounded relative to the prefix, so the error of a window
+        mean is up to about eps * t1 * max|x|. It grows with the position of
+        the window in the dataset, not with its length: about 3e-3 W/m2 after
+        120 months of 400 W/m2 fields in float32 (eps 6e-8), negligible in
+        float64.
+        '''
+
+        if bases is None:
+            bases = set()
+            for coefs in self.formulas.values():
+                bases.update(coefs)
+
+        ntime = self.dataset.shape[0]
+        for base in sorted(bases):
+            sums = np.zeros((ntime + 1,) + tuple(self.dataset.shape[1:]), dtype=storage['dtype'])
+            counts = None
+            for t in range(0, ntime, self.chunk):
+                tend = min(t + self.chunk, ntime)
+                window = self.dataset.read(base, t, tend)
+                mask = np.isnan(window)
+                np.cumsum(np.where(mask, 0, window), axis=0, dtype=sums.dtype, out=sums[t+1:tend+1])
+                sums[t+1:tend+1] += sums[t]
+                if counts is None and mask.any():
+                    # months before t were all valid
+                    counts = np.zeros(sums.shape, dtype=np.int32)
+                    counts[:t+1] = np.arange(t + 1)[:,np.newaxis,np.newaxis]
+                if counts is not None:
+                    np.cumsum(~mask, axis=0, dtype=np.int32, out=counts[t+1:tend+1])
+                    counts[t+1:tend+1] += counts[t]
+            self.sums[base] = sums
+            self.counts[base] = counts
+            for key in [k for k in self.cache if k[0] == 'base:' + base]:
+                del self.cache[key]
+                self.cache_order.remove(key)
+
+    def base_mean(self, base, tstart, tend):
+        '''
+        mean of a base field over months [tstart, tend), from the prefix sums
+        if they were built, otherwise read chunk by chunk
+        '''
+
+        def compute_prefix():
+            sums, counts = self.sums[base], self.counts[base]
+            total = sums[tend].astype(np.float64) - sums[tstart]
+            if counts is None:
+                return total / (tend - tstart)
+            count = counts[tend] - counts[tstart]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return np.where(count > 0, total / count, np.nan)
+
+        def compute():
+            total = None
+            count = None
+            for t in range(tstart, tend, self.chunk):
+                window = self.dataset.read(base, t, min(t + self.chunk, tend))
+                valid = np.isfinite(window)
+                s = np.where(valid, window, 0).sum(axis=0, dtype=np.float64)
+                c = valid.sum(axis=0)
+                if total is None:
+                    total, count = s, c
+                else:
+                    total += s
+                    count += c
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return np.where(count > 0, total / count, np.nan)
+
+        if base in self.sums:
+            return self._cached(('base:' + base, tstart, tend), compute_prefix)
+        return self._cached(('base:' + base, tstart, tend), compute)
+
+    def window_mean(self, name, tstart, tend):
+        '''
+        mean of a base or derived variable over months [tstart, tend)
+        '''
+
+        coefs = self.formulas.get(name, {name: 1.})
+
+        def compute():
+            result = None
+            for base in sorted(coefs):
+                term = self.base_mean(base, tstart, tend) * coefs[base]
+                result = term if result is None else result + term
+            return result
+
+        return self._cached((name, tstart, tend), compute)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_follow.py
+
+Tail-following of the SIRTA 1a 1-min files while they are written during
+the day (radflux_1a_*.txt, meteoz1_1a_*.asc).
+
+FollowReader remembers the byte offset after the last complete line it
+parsed. Each poll reads only what was appended since, leaves a line still
+being written for the next poll, and appends the new rows to buffers
+preallocated for a full day, which grow by doubling if needed. The parsed
+series are views of those buffers, so nothing is copied or parsed twice.
+"""
+
+import os
+
+import numpy as np
+
+from radflux_utils import parse_1a_lines
+
+
+class GrowableArray(object):
+
+    '''
+    array growing along its first axis, stored in a buffer with room to spare
+    '''
+
+    def __init__(self, shape=(), dtype=np.float64, capacity=1440):
+
+        self.buffer = np.empty((capacity,) + tuple(shape), dtype=dtype)
+        self.n = 0
+
+    def resize(self, n):
+        '''
+        sets the length to n, new rows are not initialized.
+        Views taken before a resize may not see later rows.
+        '''
+
+        if n > len(self.buffer):
+            buffer = np.empty((max(n, 2 * len(self.buffer)),) + self.buffer.shape[1:], dtype=self.buffer.dtype)
+            buffer[:self.n] = self.buffer[:self.n]
+            self.buffer = buffer
+        self.n = n
+
+    def append(self, rows):
+
+        i = self.n
+        self.resize(i + len(rows))
+        self.buffer[i:self.n] = rows
+
+    @property
+    def data(self):
+
+        return self.buffer[:self.n]
+
+
+class FollowReader(object):
+
+    '''
+    incremental reader of a growing 1a file
+    '''
+
+    def __init__(self, filename, capacity=1440):
+
+        self.filename = filename
+        self.capacity = capacity
+        self.restart()
+
+    def restart(self):
+
+        self.offset = 0
+        self.time = GrowableArray(capacity=self.capacity)
+        # created with the number of columns of the first rows
+        self.values = None
+
+    def poll(self):
+        '''
+        parses the complete lines appended since the last poll.
+        returns (first, n): the rows first to n-1 are new, first is 0 when
+        the file was rewritten and everything was read again.
+        '''
+
+        try:
+            size = os.path.getsize(self.filename)
+        except OSError:
+            return self.time.n, self.time.n
+        if size < self.offset:
+            # a shorter file is a new file
+            self.restart()
+        first = self.time.n
+        if size == self.offset:
+            return first, first
+
+        with open(self.filename, 'rb') as f:
+            f.seek(self.offset)
+            chunk = f.read(size - self.offset)
+        # a line being written is left for the next poll
+        end = chunk.rfind('\n') + 1
+        self.offset += end
+        lines = [l for l in chunk[:end].splitlines(True) if l[:1].isdigit()]
+        if len(lines) < 1:
+            return first, first
+
+        time, x = parse_1a_lines(lines, self.filename)
+        if self.values is None:
+            self.values = GrowableArray(x.shape[1:], capacity=self.capacity)
+        self.time.append(time)
+        self.values.append(x)
+        return first, self.time.n
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_lod.py
+
+Level-of-detail decimation of long time series for display.
+
+Envelope precomputes, once per loaded series, a pyramid of min/max levels
+(blocks of 4, 16, 64... samples). For a visible time window and a plot width
+in pixels it returns either the raw samples, when there are few enough of
+them, or the min/max envelope of the coarsest level that still gives about
+one block per pixel. Each block gives two points, its min then its max, at
+the block start time, so that the plotted line covers the full range of the
+samples it stands for.
+The same levels answer min/max queries over any time range, e.g. for
+vertical autoscaling, without scanning the samples.
+When the series grows, update only reduces the blocks holding new samples.
+"""
+
+import numpy as np
+
+
+class Envelope(object):
+
+    def __init__(self, time, values, factor=4, min_blocks=256):
+        '''
+        time is the sorted time axis shared by the arrays in the dict values
+        '''
+
+        self.factor = factor
+        self.min_blocks = min_blocks
+        # levels[k] = (block size, block start times, {name: (mins, maxs)})
+        self.levels = []
+        self.update(time, values, 0)
+
+    def update(self, time, values, unchanged=None):
+        '''
+        takes a longer version of the series (e.g. a growing file), whose
+        first unchanged samples (by default, all the previous ones) are the
+        same. Only the blocks holding new samples are reduced again.
+        '''
+
+        if unchanged is None:
+            unchanged = len(self.time)
+        self.time = np.asarray(time, dtype=np.float64)
+        self.values = dict([(name, np.asarray(values[name])) for name in values])
+        factor = self.factor
+
+        n = len(self.time)
+        block = factor
+        k = 0
+        with np.errstate(invalid='ignore'):
+            while n // block >= self.min_blocks:
+                nblocks = -(-n // block)
+                # first block with new samples, the ones before it are kept
+                j0 = min(unchanged // block, len(self.levels[k][1]) if k < len(self.levels) else 0)
+                reduced = {}
+                for name in self.values:
+                    if k == 0:
+                        # first level, from the raw samples
+                        x = self._pad(self.values[name][j0*block:], (nblocks - j0) * block).reshape(-1, block)
+                        new = (np.fmin.reduce(x, axis=1), np.fmax.reduce(x, axis=1))
+                    else:
+                        mins, maxs = self.levels[k-1][2][name]
+                        m = self._pad(mins[j0*factor:], (nblocks - j0) * factor).reshape(-1, factor)
+                        M = self._pad(maxs[j0*factor:], (nblocks - j0) * factor).reshape(-1, factor)
+                        new = (np.fmin.reduce(m, axis=1), np.fmax.reduce(M, axis=1))
+                    if j0 > 0:
+                        old = self.levels[k][2][name]
+                        new = (np.r_[old[0][:j0], new[0]], np.r_[old[1][:j0], new[1]])
+                    reduced[name] = new
+                level = (block, self.time[::block], reduced)
+                if k < len(self.levels):
+                    self.levels[k] = level
+                else:
+                    self.levels.append(level)
+                block *= factor
+                k += 1
+        del self.levels[k:]
+
+    def _pad(self, x, n):
+
+        if len(x) == n:
+            return x
+        padded = np.empty(n, dtype=np.result_type(x.dtype, np.float32))
+        padded[:len(x)] = x
+        padded[len(x):] = np.nan
+        return padded
+
+    def window(self, t0, t1, npixels, names=None):
+        '''
+        returns (time, {name: values}) to plot for the window [t0, t1] on
+        npixels pixels. The first and last samples of the series are always
+        included, so that the extent of the plotted data stays the full record.
+        '''
+
+        if names is None:
+            names = list(self.values)
+        n = len(self.time)
+        if n < 1:
+            return self.time, dict([(name, self.values[name]) for name in names])
+
+        i0 = max(np.searchsorted(self.time, t0, 'left') - 1, 0)
+        i1 = min(np.searchsorted(self.time, t1, 'right') + 1, n)
+        nvisible = i1 - i0
+
+        # coarsest level with at least one block per pixel, raw samples
+        # when even the finest level would have more blocks than samples shown
+        level = None
+        for lvl in self.levels:
+            if lvl[0] * max(npixels, 1) > nvisible:
+                break
+            level = lvl
+
+        if level is None:
+            time = self.time[i0:i1]
+            values = dict([(name, self.values[name][i0:i1]) for name in names])
+        else:
+            block, btime, reduced = level
+            j0, j1 = i0 // block, -(-i1 // block)
+            time = np.repeat(btime[j0:j1], 2)
+            values = {}
+            for name in names:
+                mins, maxs = reduced[name]
+                v = np.empty(2 * (j1 - j0))
+                v[0::2] = mins[j0:j1]
+                v[1::2] = maxs[j0:j1]
+                values[name] = v
+
+        # keep the full extent for the range tools
+        if len(time) == 0 or time[0] > self.time[0]:
+            time = np.r_[self.time[0], time]
+            for name in names:
+                values[name] = np.r_[self.values[name][0], values[name]]
+        if time[-1] < self.time[-1]:
+            time = np.r_[time, self.time[-1]]
+            for name in names:
+                values[name] = np.r_[values[name], self.values[name][-1]]
+        return time, values
+
+    def _extent(self, name, i0, i1, k):
+
+        if i1 <= i0:
+            return np.nan, np.nan
+        if k < 0:
+            x = self.values[name][i0:i1]
+            return np.fmin.reduce(x), np.fmax.reduce(x)
+
+        # whole blocks of level k, and what is left on each side from finer levels
+        block, btime, reduced = self.levels[k]
+        j0, j1 = -(-i0 // block), i1 // block
+        if j0 >= j1:
+            return self._extent(name, i0, i1, k - 1)
+        mins, maxs = reduced[name]
+        left = self._extent(name, i0, j0 * block, k - 1)
+        right = self._extent(name, j1 * block, i1, k - 1)
+        low = np.fmin.reduce([np.fmin.reduce(mins[j0:j1]), left[0], right[0]])
+        high = np.fmax.reduce([np.fmax.reduce(maxs[j0:j1]), left[1], right[1]])
+        return low, high
+
+    def extent(self, name, t0, t1):
+        '''
+        (min, max) of the finite values of a series over the time range [t0, t1],
+        NaN if there are none. Uses the pyramid levels, so the cost is
+        logarithmic in the number of samples in the range.
+        '''
+
+        i0 = np.searchsorted(self.time, t0, 'left')
+        i1 = np.searchsorted(self.time, t1, 'right')
+        k = len(self.levels) - 1
+        while k >= 0 and self.levels[k][0] > i1 - i0:
+            k -= 1
+        with np.errstate(invalid='ignore'):
+            return self._extent(name, i0, i1, k)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
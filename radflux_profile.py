@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_profile.py
+
+Stage timers and memory counters for the load, compute and render steps of
+rfts, rfspace and the readers.
+
+Profiling is off by default. It can be turned on through the environment:
+    RADFLUX_PROFILE=1           records are written to stderr
+    RADFLUX_PROFILE=file.jsonl  records are appended to a JSON-lines file
+with the --profile [file] flag of the scripts, with set_profiling, or from the
+Performance entry of the Help menu of the GUIs (records are then only kept in
+memory). When it is off, a profiled function or stage() block costs a dict
+lookup and a function call.
+
+Each stage gives one JSON record, e.g.
+    {"stage": "radflux_read", "file": "data/radflux_1a_...txt", "seconds": 0.031,
+     "cpu_seconds": 0.03, "rss_mb": 85.2, "rss_delta_mb": 4.1, "peak_mb": 90.0,
+     "parent": "RFTimeSeries.open_day", "depth": 1, "start": 1400000000.1, "pid": 1234}
+Nested stages come out before their parent. The last records are kept for
+summary() and report().
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import functools
+import collections
+
+
+def _output_from_env(value):
+
+    if value in ('', '0'):
+        return None
+    return '-' if value == '1' else value
+
+
+settings = {
+    'enabled': os.environ.get('RADFLUX_PROFILE', '0') not in ('', '0'),
+    # None: records only kept in memory, '-': stderr, otherwise a file name
+    'output': _output_from_env(os.environ.get('RADFLUX_PROFILE', '0')),
+}
+
+records = collections.deque(maxlen=5000)
+
+# stages being timed, innermost last
+_stack = []
+
+
+def set_profiling(enabled, output=None):
+    '''
+    turns profiling on or off. output is None to keep records in memory only,
+    '-' for stderr, or a JSON-lines file the records are appended to.
+    '''
+    settings['enabled'] = bool(enabled)
+    settings['output'] = output
+
+
+def peak_mb():
+    '''
+    peak resident memory of the process in MB
+    '''
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on Mac OS, kilobytes on Linux
+    return maxrss / 1024. ** (2 if sys.platform == 'darwin' else 1)
+
+
+def rss_mb():
+    '''
+    current resident memory of the process in MB, the peak where /proc is not available
+    '''
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024. ** 2
+    except (IOError, OSError):
+        return peak_mb()
+
+
+def emit(record):
+
+    records.append(record)
+    output = settings['output']
+    if output is None:
+        return
+    line = json.dumps(record, sort_keys=True) + '\n'
+    if output == '-':
+        sys.stderr.write(line)
+    else:
+        # one write per record, so that worker processes can share the file
+        with open(output, 'a') as f:
+            f.write(line)
+
+
+class Stage(object):
+
+    def __init__(self, name, info):
+
+        self.name = name
+        self.info = info
+
+    def __enter__(self):
+
+        self.parent = _stack[-1].name if len(_stack) > 0 else None
+        self.depth = len(_stack)
+        _stack.append(self)
+        self.rss = rss_mb()
+        self.cpu = sum(os.times()[:2])
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        seconds = time.time() - self.start
+        cpu_seconds = sum(os.times()[:2]) - self.cpu
+        _stack.remove(self)
+        rss = rss_mb()
+        record = {'stage': self.name, 'seconds': seconds, 'cpu_seconds': cpu_seconds,
+                  'rss_mb': rss, 'rss_delta_mb': rss - self.rss, 'peak_mb': peak_mb(),
+                  'parent': self.parent, 'depth': self.depth, 'start': self.start, 'pid': os.getpid()}
+        record.update(self.info)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        emit(record)
+        return False
+
+
+class NoStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+no_stage = NoStage()
+
+
+def stage(name, **info):
+    '''
+    context manager timing a block as a stage, info goes in its record.
+    returns a shared do-nothing context when profiling is off.
+    '''
+
+    if not settings['enabled']:
+        return no_stage
+    return Stage(name, info)
+
+
+def profiled(name=None):
+    '''
+    decorator timing every call of a function as a stage (named after the
+    function by default). A file name given as first argument goes in the record.
+    Not for trait handlers: traits reads their argument count, which the
+    wrapper hides. Time those with a stage() block in their body.
+    '''
+
+    def decorator(func):
+
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            if not settings['enabled']:
+                return func(*args, **kwargs)
+            info = {}
+            if len(args) > 0 and isinstance(args[0], basestring):
+                info['file'] = args[0]
+            with Stage(stage_name, info):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def time_draws(component, name):
+    '''
+    times the draws of a chaco component (e.g. a Plot shown in a window)
+    as stages named 'draw name'
+    '''
+
+    draw = component.draw
+    stage_name = 'draw ' + name
+
+    def timed_draw(*args, **kwargs):
+
+        if not settings['enabled']:
+            return draw(*args, **kwargs)
+        with Stage(stage_name, {}):
+            return draw(*args, **kwargs)
+
+    component.draw = timed_draw
+
+
+def clear():
+
+    records.clear()
+
+
+def summary():
+    '''
+    per-stage statistics of the kept records, by decreasing total time:
+    list of dicts with stage, count, total, mean and max seconds and the
+    largest memory increase in MB
+    '''
+
+    stages = collections.OrderedDict()
+    for record in records:
+        stats = stages.setdefault(record['stage'], {'stage': record['stage'], 'count': 0, 'total': 0.,
+                                                    'max': 0., 'rss_delta_mb': 0.})
+        stats['count'] += 1
+        stats['total'] += record['seconds']
+        stats['max'] = max(stats['max'], record['seconds'])
+        stats['rss_delta_mb'] = max(stats['rss_delta_mb'], record['rss_delta_mb'])
+    result = list(stages.values())
+    for stats in result:
+        stats['mean'] = stats['total'] / stats['count']
+    result.sort(key=lambda stats: -stats['total'])
+    return result
+
+
+def report():
+    '''
+    summary() as a text table
+    '''
+
+    if not settings['enabled'] and len(records) < 1:
+        return 'Profiling is off.'
+    lines = ['%-36s %6s %9s %9s %9s %9s' % ('stage', 'count', 'total s', 'mean s', 'max s', '+MB')]
+    for stats in summary():
+        lines.append('%-36s %6d %9.4f %9.4f %9.4f %9.1f' % (stats['stage'][:36], stats['count'], stats['total'],
+                                                            stats['mean'], stats['max'], stats['rss_delta_mb']))
+    lines.append('')
+    lines.append('memory: %.1f MB, peak %.1f MB' % (rss_mb(), peak_mb()))
+    return '\n'.join(lines)
+
+
+def show_performance(parent=None):
+    '''
+    opens the Performance window of the GUIs, with the report of the stages
+    and a switch to turn profiling on or off
+    '''
+
+    # only the GUIs need traits
+    from traits.api import HasTraits, Bool, Str, Button
+    from traitsui.api import View, VGroup, HGroup, Item, UItem, CodeEditor
+
+    class Performance(HasTraits):
+
+        enabled = Bool(settings['enabled'])
+        text = Str(report())
+        refresh_button = Button('Refresh')
+        clear_button = Button('Clear')
+
+        traits_view = View(
+            VGroup(
+                HGroup(
+                    Item('enabled', label='Profiling'),
+                    UItem('refresh_button'),
+                    UItem('clear_button'),
+                ),
+                UItem('text', editor=CodeEditor(show_line_numbers=False), style='readonly'),
+            ),
+            resizable=True,
+            width=700,
+            height=400,
+            title='Performance',
+        )
+
+        def _enabled_changed(self):
+
+            set_profiling(self.enabled, settings['output'])
+            self.text = report()
+
+        def _refresh_button_fired(self):
+
+            self.text = report()
+
+        def _clear_button_fired(self):
+
+            clear()
+            self.text = report()
+
+    Performance().edit_traits(parent=parent, kind='live')
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
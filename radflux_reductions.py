@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_reductions.py
+
+Area-weighted reductions of the CERES fields: global means, zonal means and
+time x latitude (Hovmoller) diagrams.
+
+Each base field is reduced in one chunked pass over the record, keeping the
+zonal sums and valid-pixel counts per (time, latitude). Zonal means, the
+Hovmoller diagram and the cos(latitude) weighted global mean all derive from
+these, and are cached. Derived variables are handled through their linear
+formulas, like in radflux_derived. Missing values are NaN in and out.
+"""
+
+import numpy as np
+
+
+class Reductions(object):
+
+    '''
+    reductions of the variables of a dataset providing lat, shape and
+    read(name, tstart, tend) (e.g. CeresDataset).
+    formulas is a dict {name: {base field: coefficient}}
+    '''
+
+    def __init__(self, dataset, formulas=None, chunk=12):
+
+        self.dataset = dataset
+        self.formulas = formulas or {}
+        self.chunk = chunk
+        # cos(latitude) area weights, computed once
+        self.weights = np.cos(np.deg2rad(np.asarray(dataset.lat, dtype=np.float64)))
+        self.zonal_sums = {}
+        self.zonal_counts = {}
+        self.cache = {}
+
+    def _reduce_base(self, base):
+
+        if base in self.zonal_sums:
+            return
+        ntime, nlat = self.dataset.shape[0], self.dataset.shape[1]
+        sums = np.zeros((ntime, nlat))
+        counts = np.zeros((ntime, nlat), dtype=np.int32)
+        for t in range(0, ntime, self.chunk):
+            tend = min(t + self.chunk, ntime)
+            window = self.dataset.read(base, t, tend)
+            valid = np.isfinite(window)
+            sums[t:tend] = np.where(valid, window, 0).sum(axis=2, dtype=np.float64)
+            counts[t:tend] = valid.sum(axis=2)
+        self.zonal_sums[base] = sums
+        self.zonal_counts[base] = counts
+
+    def _combine(self, name, reduction):
+
+        key = (name, reduction)
+        if key not in self.cache:
+            coefs = self.formulas.get(name, {name: 1.})
+            result = None
+            for base in sorted(coefs):
+                self._reduce_base(base)
+                term = getattr(self, '_' + reduction)(base) * coefs[base]
+                result = term if result is None else result + term
+            self.cache[key] = result
+        return self.cache[key]
+
+    def _hovmoller(self, base):
+
+        counts = self.zonal_counts[base]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, self.zonal_sums[base] / counts, np.nan)
+
+    def _global(self, base):
+
+        wsums = np.dot(self.zonal_sums[base], self.weights)
+        wcounts = np.dot(self.zonal_counts[base], self.weights)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(wcounts > 0, wsums / wcounts, np.nan)
+
+    def hovmoller(self, name):
+        '''
+        (time, lat) zonal means of a variable over the whole record
+        '''
+
+        return self._combine(name, 'hovmoller')
+
+    def global_mean(self, name):
+        '''
+        area-weighted global mean time series of a variable
+        '''
+
+        return self._combine(name, 'global')
+
+    def zonal_mean(self, name, tstart, tend):
+        '''
+        zonal mean profile of a variable over months [tstart, tend)
+        '''
+
+        zonal = self.hovmoller(name)[tstart:tend]
+        valid = np.isfinite(zonal)
+        count = valid.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, np.where(valid, zonal, 0).sum(axis=0) / count, np.nan)
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_series.py
+
+Loads all the radflux and meteo files of a data directory that cover a date
+range into one continuous station time series.
+Files are parsed in a process pool, then copied into contiguous preallocated
+arrays. Gaps between files are kept explicit: a NaN sample is inserted in the
+arrays so that plots do not join across them, and the gap limits are listed
+in series['gaps'].
+"""
+
+import os
+import calendar
+import multiprocessing
+from datetime import datetime, date
+
+import numpy as np
+
+from radflux_utils import radflux_read, meteo_read, radflux_year_read, meteo_year_read
+from radflux_utils import clearsky_batch, as_float, storage
+from radflux_catalog import get_catalog
+from radflux_align import align
+
+
+# station columns, all on the radflux time axis
+COLUMNS = ['solar angle', 'total SW flux', 'LW flux', 'sw_clearsky', 'lw_clearsky', 'sw_diff', 'lw_diff']
+
+
+def to_epoch(t):
+
+    if isinstance(t, datetime):
+        return calendar.timegm(t.utctimetuple()) + t.microsecond * 1e-6
+    if isinstance(t, date):
+        return float(calendar.timegm(t.timetuple()))
+    return float(t)
+
+
+def find_station_files(path, t0, t1):
+    '''
+    returns a list of (start, end, kind, filename) for the radflux files in path
+    overlapping [t0, t1], sorted by start time. kind is 'day' or 'year'.
+    '''
+
+    t0, t1 = to_epoch(t0), to_epoch(t1)
+    catalog = get_catalog(path)
+    files = []
+    for kind in ('day', 'year'):
+        for start, end, filename in catalog.find('radflux_' + kind, t0, t1):
+            files.append((start, end, kind, filename))
+    files.sort()
+    return files
+
+
+def add_clearsky(time, data, meteo):
+    '''
+    aligns the meteo temperature and rh on the radflux time axis and adds
+    them to data, with sw_clearsky, lw_clearsky and sw_diff, lw_diff the
+    measured fluxes minus those. The clear-sky columns of year files are
+    kept, the models computed from the aligned meteo then go in
+    sw_clearsky_model and lw_clearsky_model. Without meteo, temperature, rh
+    and the LW model are NaN.
+    '''
+
+    if meteo is not None:
+        # meteo and radflux files do not always cover the same minutes
+        aligned = align(meteo['time'], {'temperature':meteo['temperature'], 'rh':meteo['rh']}, time)
+    else:
+        aligned = {'temperature':np.zeros(len(time)) + np.nan, 'rh':np.zeros(len(time)) + np.nan}
+    data.update(aligned)
+    if 'sw_clearsky' not in data and 'lw_clearsky' not in data:
+        data.update(clearsky_batch(data['solar angle'], data['total SW flux'],
+                                   aligned['temperature'], aligned['rh'], data['LW flux']))
+        return
+
+    model = clearsky_batch(data['solar angle'], temp=aligned['temperature'], rh=aligned['rh'])
+    for name in ('sw_clearsky', 'lw_clearsky'):
+        if name in data:
+            data[name + '_model'] = model[name]
+        else:
+            data[name] = model[name]
+    data['sw_diff'] = data['total SW flux'] - data['sw_clearsky']
+    data['lw_diff'] = data['LW flux'] - data['lw_clearsky']
+
+
+def load_station_file(args):
+    '''
+    reads one radflux file and its companion meteo file,
+    returns (time, columns, meteo time, meteo temperature)
+    '''
+
+    kind, filename = args
+    path = os.path.dirname(filename)
+    if kind == 'day':
+        time, data, filedate = radflux_read(filename)
+        meteo = meteo_read(filedate, path)
+    else:
+        data = radflux_year_read(filename)
+        if data is None:
+            return None
+        time = data['time']
+        meteo = meteo_year_read(data['date'].year, path)
+    add_clearsky(time, data, meteo)
+    if meteo is not None:
+        mtime, temperature = meteo['time'], meteo['temperature']
+    else:
+        mtime, temperature = np.zeros(0), np.zeros(0)
+
+    columns = dict([(name, as_float(data[name])) for name in COLUMNS])
+    return np.asarray(time, dtype=np.float64), columns, np.asarray(mtime, dtype=np.float64), as_float(temperature)
+
+
+def _clip(time, t0, t1, after):
+
+    # keeps samples in [t0, t1], later than the end of the previous chunk
+    return (time >= t0) & (time <= t1) & (time > after)
+
+
+def _concatenate(chunks, names, t0, t1, gap_factor):
+
+    # first pass: sizes and gaps, second pass: copy into preallocated arrays
+    keep = []
+    gaps = []
+    n = 0
+    last = -np.inf
+    for time, columns in chunks:
+        idx = _clip(time, t0, t1, last)
+        if not np.any(idx):
+            keep.append(None)
+            continue
+        ctime = time[idx]
+        step = np.median(np.diff(ctime)) if len(ctime) > 1 else 60.
+        gap = np.isfinite(last) and (ctime[0] - last) > gap_factor * step
+        if gap:
+            gaps.append((last, ctime[0]))
+        keep.append((idx, gap, last))
+        n += np.sum(idx) + gap
+        last = ctime[-1]
+
+    time = np.empty(n)
+    arrays = dict([(name, np.empty(n, dtype=storage['dtype'])) for name in names])
+    i = 0
+    for (ctime, columns), k in zip(chunks, keep):
+        if k is None:
+            continue
+        idx, gap, previous = k
+        if gap:
+            # a single NaN sample, right after the end of the previous chunk
+            time[i] = previous + 1.
+            for name in names:
+                arrays[name][i] = np.nan
+            i += 1
+        m = np.sum(idx)
+        time[i:i+m] = ctime[idx]
+        for name in names:
+            arrays[name][i:i+m] = columns[name][idx]
+        i += m
+
+    return time, arrays, gaps
+
+
+def load_station_series(path, t0, t1, processes=None, gap_factor=1.5):
+    '''
+    loads all radflux (day and year) files in path covering [t0, t1],
+    with their meteo files, in a pool of processes (default: one per core).
+    t0 and t1 are datetimes, dates or epoch seconds.
+    returns None if no file matches, otherwise a dict with
+        'time' and the COLUMNS, contiguous arrays on the radflux time axis
+        'date' the date of the first sample
+        'meteo' a dict with 'epochtime' and 'temperature'
+        'gaps' a list of (end, start) epoch times between non-contiguous files
+    a gap is any jump larger than gap_factor times the sampling step.
+    '''
+
+    t0, t1 = to_epoch(t0), to_epoch(t1)
+    files = find_station_files(path, t0, t1)
+    if len(files) < 1:
+        return None
+
+    jobs = [(kind, filename) for (start, end, kind, filename) in files]
+    if processes == 1 or len(jobs) == 1:
+        results = [load_station_file(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(load_station_file, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    results = [r for r in results if r is not None]
+    if len(results) < 1:
+        return None
+
+    time, series, gaps = _concatenate([(r[0], r[1]) for r in results], COLUMNS, t0, t1, gap_factor)
+    mtime, meteo, mgaps = _concatenate([(r[2], {'temperature': r[3]}) for r in results], ['temperature'], t0, t1, gap_factor)
+    if len(time) < 1:
+        return None
+
+    series['time'] = time
+    series['date'] = datetime.utcfromtimestamp(time[0])
+    series['gaps'] = gaps
+    series['meteo'] = {'epochtime': mtime, 'temperature': meteo['temperature']}
+    return series
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
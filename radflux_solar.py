@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_solar.py
+
+Solar geometry: solar zenith angle for arrays of epoch times at a site,
+following the NOAA solar position algorithm (about 0.01 deg from 1800 to 2100),
+without atmospheric refraction.
+Results are memoized on (site, time grid), since the same grids come back
+each time a file is displayed.
+
+running this module (or bench_suite.py --check) compares the computation with
+the hourly table data/solar_angle_SIRTA_year.txt previously used by
+solar_year_read, and fails if they differ by more than TABLE_TOLERANCE.
+"""
+
+import sys
+import hashlib
+
+import numpy as np
+
+
+# latitude (deg N), longitude (deg E)
+SITES = {'SIRTA': (48.713, 2.208)}
+
+cache = {}
+cache_order = []
+CACHE_SIZE = 8
+
+
+def site_coordinates(site):
+
+    if isinstance(site, basestring):
+        return SITES[site]
+    return tuple(site)
+
+
+def _zenith(time, lat, lon):
+
+    rad = np.pi / 180.
+    jc = (time / 86400. + 2440587.5 - 2451545.) / 36525.
+
+    mean_long = np.mod(280.46646 + jc * (36000.76983 + jc * 0.0003032), 360.)
+    mean_anom = 357.52911 + jc * (35999.05029 - 0.0001537 * jc)
+    ecc = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+    manom = mean_anom * rad
+    center = np.sin(manom) * (1.914602 - jc * (0.004817 + 0.000014 * jc)) \
+        + np.sin(2 * manom) * (0.019993 - 0.000101 * jc) + np.sin(3 * manom) * 0.000289
+    omega = (125.04 - 1934.136 * jc) * rad
+    app_long = (mean_long + center - 0.00569 - 0.00478 * np.sin(omega)) * rad
+    mean_obliq = 23. + (26. + (21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))) / 60.) / 60.
+    obliq = (mean_obliq + 0.00256 * np.cos(omega)) * rad
+    decl = np.arcsin(np.sin(obliq) * np.sin(app_long))
+
+    y = np.tan(obliq / 2.) ** 2
+    mlong = mean_long * rad
+    eq_time = 4. / rad * (y * np.sin(2 * mlong) - 2 * ecc * np.sin(manom)
+                          + 4 * ecc * y * np.sin(manom) * np.cos(2 * mlong)
+                          - 0.5 * y * y * np.sin(4 * mlong) - 1.25 * ecc * ecc * np.sin(2 * manom))
+
+    # true solar time in minutes, then hour angle
+    minutes = np.mod(time, 86400.) / 60.
+    solar_time = np.mod(minutes + eq_time + 4. * lon, 1440.)
+    hour_angle = (solar_time / 4. - 180.) * rad
+
+    cos_zenith = np.sin(lat * rad) * np.sin(decl) + np.cos(lat * rad) * np.cos(decl) * np.cos(hour_angle)
+    return np.arccos(np.clip(cos_zenith, -1., 1.)) / rad
+
+
+def solar_zenith_angle(time, site='SIRTA'):
+    '''
+    solar zenith angle in degrees for epoch times (seconds, UTC) at a site,
+    given by name (see SITES) or as (latitude, longitude) in degrees.
+    '''
+
+    lat, lon = site_coordinates(site)
+    time = np.asarray(time, dtype=np.float64)
+    key = (lat, lon, time.shape, hashlib.sha1(np.ascontiguousarray(time).view(np.uint8)).hexdigest())
+    if key in cache:
+        return cache[key]
+
+    angle = _zenith(time, lat, lon)
+    angle.flags.writeable = False
+    cache[key] = angle
+    cache_order.append(key)
+    while len(cache_order) > CACHE_SIZE:
+        del cache[cache_order.pop(0)]
+    return angle
+
+
+# largest accepted difference with the table, in degrees (it is 0.38 with data/)
+TABLE_TOLERANCE = 0.5
+
+
+def compare_with_table(path='data', tolerance=TABLE_TOLERANCE):
+    '''
+    compares the computed angles with the hourly table in path.
+    returns the differences in degrees, raises ValueError if one of them
+    is larger than tolerance.
+    '''
+
+    from radflux_utils import read_table_file, epoch_from_fields
+
+    x = read_table_file(path + '/solar_angle_SIRTA_year.txt')
+    # the table has no year, it is compared with a leap year so that Feb 29 is kept.
+    # its hour column runs from 1 to 24 and gives the angle at that hour, UTC
+    time, valid = epoch_from_fields(2008, x[:,0], x[:,1], x[:,2] - 1)
+    time, angle = time[valid] + 3600., x[valid,3]
+    diff = solar_zenith_angle(time) - angle
+    maxdiff = np.max(np.abs(diff))
+    print 'solar zenith angle - table, %d hours' % len(time)
+    print 'mean %6.3f deg, rms %6.3f deg, max abs %6.3f deg' % (np.mean(diff), np.sqrt(np.mean(diff ** 2)), maxdiff)
+    # also fails on NaN
+    if not maxdiff < tolerance:
+        raise ValueError('solar zenith angle differs from the table by %.3f deg (tolerance %.3f deg)' % (maxdiff, tolerance))
+    return diff
+
+
+def main():
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    try:
+        compare_with_table(path)
+    except ValueError as e:
+        print e
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+radflux_synth.py
+
+Deterministic synthetic data for benchmarks, in the formats the readers expect:
+  - CERES EBAF-TOA shaped cubes (months x 180 x 360), as NetCDF for
+    ceres_nc_read / CeresDataset, or as HDF5 for ceres_read
+  - SIRTA 1-min day files (radflux_1a_*.txt, meteoz1_1a_*.asc) over any
+    number of days
+  - SIRTA hourly year files (radflux_YYYY.txt, MeteoZ1_SIRTA_Z1_1hourYYYY.txt)
+  - a coastlines.mat of random NaN-separated polylines
+
+Values follow the solar zenith angle, the clear-sky models and a seasonal and
+diurnal cycle, with random clouds. The same arguments always give the same files.
+
+usage: python radflux_synth.py outdir [ndays] [nmonths]
+"""
+
+import os
+import sys
+
+import numpy as np
+
+from radflux_solar import solar_zenith_angle
+from radflux_utils import clearsky_batch
+
+
+RADFLUX_HEADER = '''# Creation date : %(created)s
+# File contains 1-min averages of Surface Downwelling Shortwave (solar)
+# and Longwave (infrared) irradiances measured at SIRTA.
+# For information concerning those files, email:sirtascience@ipsl.polytechnique.fr
+#
+# numero de serie du pyrheliometre (K&Z CH1) : 020318
+# numero de serie du pyranometre diffus (K&Z CM22) : 020058
+# numero de serie du pyrgeometre (K&Z CG4) : 020622
+# numero de serie du pyranometre global (K&Z CM22) : 090084
+#
+# 0 : Date Time (yyyy-mm-ddThh:mm:ssZ)
+# 1 : Solar Zenith Angle (deg)
+#
+# 2, 3, 4, 5: 1-min average values
+# 2 : Direct Solar Flux (W/m2)
+# 3 : Diffuse Solar Flux (W/m2)
+# 4 : Global Solar Flux (W/m2)
+# 5 : Downwelling IR Flux (W/m2)
+#
+# 6, 7, 8, 9: 1-min minimum values
+# 6 : Direct Solar Flux (W/m2)
+# 7 : Diffuse Solar Flux (W/m2)
+# 8 : Global Solar Flux (W/m2)
+# 9 : Downwelling IR Flux (W/m2)
+#
+# 10, 11, 12, 13: 1-min maximum values
+# 10 : Direct Solar Flux (W/m2)
+# 11 : Diffuse Solar Flux (W/m2)
+# 12 : Global Solar Flux (W/m2)
+# 13 : Downwelling IR Flux (W/m2)
+#
+# 14, 15, 16, 17: 1-min standard deviation values
+# 14 : Direct Solar Flux (W/m2)
+# 15 : Diffuse Solar Flux (W/m2)
+# 16 : Global Solar Flux (W/m2)
+# 17 : Downwelling IR Flux (W/m2)
+#
+# 18 : number of observations per minute
+# 19, 20, 21, 22: Quality flag (0: QC Ok, 1: exceptionally high or low value, 2: value outside physical bounds, 3: missing)
+#
+#         0                1       2       3       4       5       6       7       8       9       10      11      12      13      14      15      16      17   18   19 20 21 22
+#
+'''
+
+# the SIRTA headers are latin-1, with degree signs
+METEO_HEADER = '''# Date created : %(created)s
+# Version : 3
+# 1-min average standard ground weather data
+# Calculated from 5s wind data (speed and direction) at 10 m AGL
+# and from  5s weather data (temperature, humidity, pressure, precipitation) all at 2 m AGL
+# Location : SIRTA (48.7N, 2.2E), zone 1
+# Created by : Christophe Boitel
+# For information concerning those files, contact email: sirtascience@ipsl.polytechnique.fr
+# col. 01 : Date Time (yyyy-mm-ddThh:mm:ssZ)
+# col. 02 : Wind speed (m/s)
+# col. 03 : Wind direction (degres)
+# col. 04 : Air temperature (\xb0C)
+# col. 05 : Relative humidity (%%)
+# col. 06 : Pressure (hPa)
+# col. 07 : Precipitation rate (mm/min)
+# col. 08 : 24-hr cumulated precipitation since 00UT (mm)
+# col. 09->13 : min. values (wind speed, temperature, humidity, pressure, precipitation)
+# col. 14->18 : max. values (wind speed, temperature, humidity, pressure, precipitation)
+# col. 19->24 : standard deviation (wind speed, wind direction, temperature, humidity, pressure, precipitation)
+# col. 25->30 : Number of valid observations per minute (wind speed, wind direction, temperature, humidity, pressure, precipitation)
+# col. 31->36 : Quality flag : 0 = QC check Ok (wind speed, wind dir, temperature, humidity, pressure, precipitation)
+#                              1 = beware, extreme value or low sampling
+#                              2 = exceeds physical limit tests
+#                              3 = missing or not valid
+#
+#
+#         01              02      03      04      05      06      07      08      09     10      11       12      13      14      15     16       17        18        19        20        21        22        23       24  25 26 27 28 29 30 31 32 33 34 35 36
+#
+'''
+
+RADFLUX_YEAR_HEADER = '''# Date created : 2009-10-28
+# radflux-chuck-SIRTAZ2
+# Version : 1
+# Created by Jean-Charles Dupont starting from "AAAAMMJJ.lw1" Chuck Long files
+#
+# The hourly average is processed around 30min around the hour
+# "NaN" value corresponds to missed data
+#
+# col. 01 : Year
+# col. 02 : Month
+# col. 03 : Day
+# col. 04 : Hour (TU)
+# col. 05 : Cloud fraction derived from LW analysis (%/100)
+# col. 06 : Cloud fraction derived from SW analysis (%/100)
+# col. 07 : Solar zenith angle (\xb0)
+# col. 08 : Diffuse solar downwelling irradiance in zone 2 (W/m\xb2)
+# col. 09 : Direct solar downwelling irradiance in zone 2 (W/m\xb2)
+# col. 10 : Global solar downwelling irradiance in zone 2 (W/m\xb2)
+# col. 11 : Infrared downwelling irradiance in zone 2 (W/m\xb2)
+# col. 12 : Clear-sky solar downwelling irradiance in zone 2 (W/m\xb2)
+# col. 13 : Clear-sky infrared downwelling irradiance in zone 2 (W/m\xb2)
+#
+'''
+
+METEO_YEAR_HEADER = '''# Date created : 2009-11-26
+# meteoSIRTA
+# Version : 1
+# Created by Jean-Charles Dupont starting from "meteo_3a_1h_v01_AAAAMMJJ_000000_1440.asc" file
+#
+# The hourly average is processed around 30min around the hour
+# "-999.99" value corresponds to missed data
+#
+# col. 01 : Year
+# col. 02 : Month
+# col. 03 : Day
+# col. 04 : Hour (TU)
+# col. 05 : Minute
+# col. 06 : 2m temperature in Zone 1 (\xb0C)
+# col. 07 : 2m relative humidity inz Zone 2 (%)
+# col. 08 : 2m pressure in Zone 1 (HPa)
+# col. 09 : 10m wind speed in Zone 1 (m/s)
+# col. 10 : 10m wind direction in Zone 1 (\xb0)
+# col. 11 : precipitation rate (mm/h) in Zone 2
+# col. 12 : cumulated precipitation since 00UT (mm) in Zone 2
+# col. 13 - 19 : Quality Flag
+# col. 13 : QF 2m temperature in Zone 1
+# col. 14 : QF 2m relative humidity inz Zone 2
+# col. 15 : QF 2m pressure in Zone 1
+# col. 16 : QF 10m wind speed in Zone 1
+# col. 17 : QF 10m wind direction in Zone 1
+# col. 18 : QF precipitation rate in Zone 2
+# col. 19 : QF cumulated precipitation since 00UT in Zone 2
+# quality flag: 0 = exceeds physical limit tests or missed data
+#               1 = exceeds extreme limit tests
+#
+'''
+
+
+def _epoch(day):
+
+    return float(np.datetime64(day, 's').astype(np.int64))
+
+
+def station_values(time, rng):
+    '''
+    synthetic station variables at epoch times: solar angle, SW components,
+    LW, temperature, relative humidity, cloud fraction
+    '''
+
+    n = len(time)
+    doy = np.mod(time / 86400., 365.25)
+    hour = np.mod(time / 3600., 24.)
+    angle = np.array(solar_zenith_angle(time))
+    # clouds come and go over a few hours
+    cloud = np.clip(0.5 + 0.5 * np.sin(time / 14400. + rng.uniform(0, 2 * np.pi)) + rng.normal(0, 0.15, n), 0, 1)
+    temperature = 12. + 8. * np.cos(2 * np.pi * (doy - 200.) / 365.25) + 5. * np.cos(2 * np.pi * (hour - 15.) / 24.) + rng.normal(0, 0.3, n)
+    rh = np.clip(70. - 2. * (temperature - 12.) + 15. * cloud + rng.normal(0, 2., n), 10., 100.)
+    clear = clearsky_batch(angle, temp=temperature, rh=rh)
+    sw_global = clear['sw_clearsky'] * (1. - 0.7 * cloud)
+    diffuse = sw_global * (0.15 + 0.6 * cloud)
+    direct = np.maximum(sw_global - diffuse, 0.)
+    lw = clear['lw_clearsky'] + 60. * cloud + rng.normal(0, 2., n)
+    return {'solar angle': angle, 'direct': direct, 'diffuse': diffuse, 'global': sw_global, 'lw': lw,
+            'temperature': temperature, 'rh': rh, 'cloud': cloud,
+            'sw_clearsky': clear['sw_clearsky'], 'lw_clearsky': clear['lw_clearsky']}
+
+
+def _timestamps(time):
+
+    stamps = np.datetime_as_string(time.astype(np.int64).astype('datetime64[s]'), unit='s')
+    return [str(s) + 'Z' for s in stamps]
+
+
+def write_radflux_day(filename, day, values, time):
+
+    n = len(time)
+    cols = [values['solar angle']]
+    fluxes = [values['direct'], values['diffuse'], values['global'], values['lw']]
+    cols += fluxes
+    cols += [f * 0.98 for f in fluxes]
+    cols += [f * 1.02 + 0.1 for f in fluxes]
+    cols += [np.abs(f) * 0.01 for f in fluxes]
+    x = np.column_stack(cols)
+    fmt = '%s  %8.3f' + '  %6.2f' * 16 + '  60    0  0  0  0\n'
+    with open(filename, 'wb') as f:
+        f.write(RADFLUX_HEADER % {'created': str(np.datetime64(day, 'D') + 1)})
+        for stamp, row in zip(_timestamps(time), x):
+            f.write(fmt % ((stamp,) + tuple(row)))
+
+
+def write_meteo_day(filename, day, values, time, rng):
+
+    n = len(time)
+    wind = np.abs(rng.normal(2., 1., n))
+    wdir = rng.uniform(0, 360, n)
+    pressure = 1000. + rng.normal(0, 3., n)
+    precip = np.zeros(n)
+    cumul = np.zeros(n)
+    t, rh = values['temperature'], values['rh']
+    cols = [wind, wdir, t, rh, pressure, precip, cumul,
+            wind * 0.5, t - 0.05, rh - 0.5, pressure - 0.03, precip,
+            wind * 1.5, t + 0.05, rh + 0.5, pressure + 0.03, precip,
+            wind * 0.2, wdir * 0.01, t * 0.001, rh * 0.002, pressure * 0.0001, precip]
+    x = np.column_stack(cols)
+    fmt = '%s' + '  %7.2f' * 23 + ' 12 12 12 12 12 12  0  0  0  0  0  0\n'
+    with open(filename, 'wb') as f:
+        f.write(METEO_HEADER % {'created': str(np.datetime64(day, 'D') + 1)})
+        for stamp, row in zip(_timestamps(time), x):
+            f.write(fmt % ((stamp,) + tuple(row)))
+
+
+def write_station_days(path, start='2009-07-01', ndays=366, seed=0):
+    '''
+    writes 1-min radflux_1a and meteoz1_1a day files for ndays days from start
+    (YYYY-MM-DD), returns the list of radflux file names
+    '''
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    files = []
+    for i in range(ndays):
+        day = np.datetime64(start, 'D') + i
+        tag = str(day).replace('-', '')
+        rng = np.random.RandomState(seed + i)
+        time = _epoch(day) + 60. * np.arange(1440)
+        values = station_values(time, rng)
+        rf_file = os.path.join(path, 'radflux_1a_1min_v04_%s_000000_1440.txt' % tag)
+        write_radflux_day(rf_file, day, values, time)
+        write_meteo_day(os.path.join(path, 'meteoz1_1a_1min_v03_%s_000000_1440.asc' % tag), day, values, time, rng)
+        files.append(rf_file)
+    return files
+
+
+def write_station_year(path, year, seed=0):
+    '''
+    writes the hourly radflux_YYYY.txt and MeteoZ1_SIRTA_Z1_1hourYYYY.txt files of a year,
+    returns their names
+    '''
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    rng = np.random.RandomState(seed + year)
+    t0, t1 = _epoch('%04d-01-01' % year), _epoch('%04d-01-01' % (year + 1))
+    time = np.arange(t0, t1, 3600.)
+    values = station_values(time, rng)
+    dates = time.astype(np.int64).astype('datetime64[s]')
+    months = dates.astype('datetime64[M]')
+    y = dates.astype('datetime64[Y]').astype(int) + 1970
+    m = (months - dates.astype('datetime64[Y]')).astype(int) + 1
+    d = (dates.astype('datetime64[D]') - months).astype(int) + 1
+    h = (dates - dates.astype('datetime64[D]')).astype(int) // 3600
+
+    rf_file = os.path.join(path, 'radflux_%04d.txt' % year)
+    cloud_sw = np.where(values['solar angle'] < 85, values['cloud'], np.nan)
+    with open(rf_file, 'wb') as f:
+        f.write(RADFLUX_YEAR_HEADER)
+        for i in range(len(time)):
+            f.write('%d,%d,%d,%d,%.5g,%.5g,%.5g,%.5g,%.5g,%.5g,%.5g,%.5g,%.5g\n' % (
+                y[i], m[i], d[i], h[i], values['cloud'][i], cloud_sw[i], values['solar angle'][i],
+                values['diffuse'][i], values['direct'][i], values['global'][i], values['lw'][i],
+                values['sw_clearsky'][i], values['lw_clearsky'][i]))
+
+    meteo_file = os.path.join(path, 'MeteoZ1_SIRTA_Z1_1hour%04d.txt' % year)
+    temperature = values['temperature'].copy()
+    # a few missing values, like the real files
+    temperature[rng.uniform(size=len(time)) < 0.01] = -999.99
+    with open(meteo_file, 'wb') as f:
+        f.write(METEO_YEAR_HEADER.replace('\n', '\r\n'))
+        for i in range(len(time)):
+            f.write('%d,%d,%d,%d,0,%.2f,%.2f,%.2f,%.2f,%.2f,0,0,1,1,1,1,1,1,1\r\n' % (
+                y[i], m[i], d[i], h[i], temperature[i], values['rh'][i], 1000. + rng.normal(0, 3.),
+                abs(rng.normal(2., 1.)), rng.uniform(0, 360)))
+    return rf_file, meteo_file
+
+
+def ceres_fields(nmonths, nlat=180, nlon=360, start='2003-01', seed=0):
+    '''
+    synthetic EBAF-TOA fields, (lat, lon, time in days since 2000-03-01, {name: (month, lat, lon) float32})
+    with lon in [0, 360) like EBAF
+    '''
+
+    rng = np.random.RandomState(seed)
+    lat = -90. + 180. * (np.arange(nlat) + 0.5) / nlat
+    lon = 360. * (np.arange(nlon) + 0.5) / nlon
+    months = np.datetime64(start, 'M') + np.arange(nmonths)
+    time = (months.astype('datetime64[D]') + 14 - np.datetime64('2000-03-01', 'D')).astype(np.float64)
+    season = np.cos(2 * np.pi * (months.astype(np.int64) % 12) / 12.)[:,np.newaxis,np.newaxis]
+    slat = np.sin(np.deg2rad(lat))[np.newaxis,:,np.newaxis]
+    clat = np.cos(np.deg2rad(lat))[np.newaxis,:,np.newaxis]
+    wave = np.cos(np.deg2rad(lon) * 3)[np.newaxis,np.newaxis,:]
+
+    fields = {}
+    shape = (nmonths, nlat, nlon)
+    fields['swupclr'] = (50. + 40. * np.abs(slat) - 30. * season * slat + 5. * wave + np.zeros(shape)).astype(np.float32)
+    fields['swup'] = (fields['swupclr'] + 50. + 20. * wave * clat + rng.normal(0, 5., shape)).astype(np.float32)
+    fields['lwupclr'] = (170. + 120. * clat + 10. * season * slat + np.zeros(shape)).astype(np.float32)
+    fields['lwup'] = (fields['lwupclr'] - 25. - 10. * wave * clat + rng.normal(0, 3., shape)).astype(np.float32)
+    return lat, lon, time, fields
+
+
+def ceres_file_name(path, nmonths, start='2003-01'):
+
+    months = np.datetime64(start, 'M') + np.arange(nmonths)
+    first, last = str(months[0]).replace('-', ''), str(months[-1]).replace('-', '')
+    return os.path.join(path, 'CERES_EBAF-TOA_Ed2.8_Subset_%s-%s.nc' % (first, last))
+
+
+def write_ceres_nc(filename, nmonths=120, nlat=180, nlon=360, start='2003-01', seed=0):
+    '''
+    writes an EBAF-TOA shaped NetCDF file readable by CeresDataset / ceres_nc_read
+    '''
+
+    import netCDF4
+
+    from radflux_utils import CeresDataset
+
+    lat, lon, time, fields = ceres_fields(nmonths, nlat, nlon, start, seed)
+    nc = netCDF4.Dataset(filename, 'w')
+    nc.createDimension('lon', nlon)
+    nc.createDimension('lat', nlat)
+    nc.createDimension('time', nmonths)
+    nc.createVariable('lon', 'f4', ('lon',))[:] = lon
+    nc.createVariable('lat', 'f4', ('lat',))[:] = lat
+    var = nc.createVariable('time', 'f4', ('time',))
+    var.units = 'days since 2000-03-01 00:00:00'
+    var[:] = time
+    for name in sorted(fields):
+        var = nc.createVariable(CeresDataset.ncnames[name], 'f4', ('time', 'lat', 'lon'), fill_value=-999.)
+        var.units = 'W m-2'
+        var[:] = fields[name]
+    nc.close()
+    return filename
+
+
+def write_ceres_h5(filename, nmonths=120, nlat=180, nlon=360, start='2003-01', seed=0):
+    '''
+    writes the same fields as an HDF5 file readable by ceres_read
+    '''
+
+    import h5py
+
+    lat, lon, time, fields = ceres_fields(nmonths, nlat, nlon, start, seed)
+    h5file = h5py.File(filename, 'w')
+    # 2-D coordinates, like the MATLAB files they come from
+    h5file['lon'] = lon[:,np.newaxis]
+    h5file['lat'] = lat[:,np.newaxis]
+    h5file['time'] = time[:,np.newaxis]
+    for name in sorted(fields):
+        h5file[name] = fields[name]
+    h5file.close()
+    return filename
+
+
+def write_coastlines(filename, npolylines=500, npoints=400, seed=0):
+    '''
+    writes a coastlines.mat of npolylines closed random-walk polylines,
+    as the NaN-separated (n, 2) lon, lat array coastlines_read expects
+    '''
+
+    from scipy.io import matlab
+
+    rng = np.random.RandomState(seed)
+    parts = []
+    for i in range(npolylines):
+        angle = np.linspace(0, 2 * np.pi, npoints)
+        radius = rng.uniform(1., 10.) * np.exp(np.cumsum(rng.normal(0, 0.05, npoints)))
+        radius[-1] = radius[0]
+        lon = np.clip(rng.uniform(-170., 170.) + radius * np.cos(angle), -180., 180.)
+        lat = np.clip(rng.uniform(-70., 70.) + radius * np.sin(angle), -90., 90.)
+        parts.append(np.column_stack([lon, lat]))
+        parts.append(np.zeros((1, 2)) + np.nan)
+    matlab.savemat(filename, {'tmp': np.concatenate(parts)})
+    return filename
+
+
+def main():
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'synthetic'
+    ndays = int(sys.argv[2]) if len(sys.argv) > 2 else 366
+    nmonths = int(sys.argv[3]) if len(sys.argv) > 3 else 120
+
+    write_station_days(path, ndays=ndays)
+    for year in (2009, 2010):
+        write_station_year(path, year)
+    ncfile = write_ceres_nc(ceres_file_name(path, nmonths), nmonths)
+    write_ceres_h5(ncfile[:-len('.nc')] + '.h5', nmonths)
+    write_coastlines(os.path.join(path, 'coastlines.mat'))
+    print 'synthetic data written in ', path
+
+
+if __name__ == '__main__':
+    main()
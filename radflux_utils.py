@@ -5,19 +5,55 @@ radflux_utils.py
 
 Created by Vincent Noel on 2011-07-12.
 Copyright (c) 2011 LMD/CNRS. All rights reserved.
+
+Optional backends (netCDF4, h5py, scipy) are imported by the functions that
+need them, so that importing this module only costs numpy.
+Readers and clear-sky models are stages for radflux_profile, timed around the
+cache so that cache hits show up too.
+
+Storage policy: missing values are NaN, there are no masked arrays, and each
+quantity is returned once. Station data is float64, or float32 in float32
+mode (RADFLUX_FLOAT32=1 or set_float32), epoch times are always float64.
+CERES fields keep the float32 type of the files. Columns are views of the
+parsed tables whenever the type allows it.
 """
 
+import os
+
 import numpy as np
-import glob
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from radflux_cache import cached_reader
+from radflux_profile import profiled
+from radflux_catalog import get_catalog
+from radflux_solar import solar_zenith_angle
+
+
+storage = {
+    'dtype': np.float32 if os.environ.get('RADFLUX_FLOAT32', '0') != '0' else np.float64,
+}
+
+
+def set_float32(enabled):
+    storage['dtype'] = np.float32 if enabled else np.float64
 
-import matplotlib.dates as mdates
-import h5py
-from scipy.io import matlab
 
+def as_float(x):
+    '''
+    x with the storage float type, as a view when it already has it
+    '''
+    return np.asarray(x, dtype=storage['dtype'])
 
+
+@profiled()
 def coastlines_read(path):
-    coastlines = matlab.loadmat(path + '/coastlines.mat')['tmp']
+
+    from scipy.io import matlab
+
+    coastfile = get_catalog(path).find_one('coastlines')
+    if coastfile is None:
+        coastfile = path + '/coastlines.mat'
+    coastlines = matlab.loadmat(coastfile)['tmp']
     lon = coastlines[:,0]
     lat = coastlines[:,1]
     idx = np.isfinite(lon) & np.isfinite(lat)
@@ -26,29 +62,118 @@ def coastlines_read(path):
     return lon, lat
 
 
+@profiled()
+def clearsky_batch(solar_angle=None, sw=None, temp=None, rh=None, lw=None, out=None, dtype=None, chunk=65536):
+    """
+    Clear-sky models and surface cloud effect in one pass.
+    sw_clearsky comes from solar_angle, lw_clearsky from temp and rh, and
+    sw_diff, lw_diff are the measured sw and lw fluxes minus those. Any group
+    of inputs can be left out, the matching outputs are then not computed.
+    Arrays are processed chunk by chunk with preallocated scratch buffers, the
+    models are evaluated in log space so there are no power temporaries.
+    Night-time (solar angle >= 90) clear-sky SW flux is 0, NaN angles give NaN.
+    out is an optional dict of preallocated output arrays, dtype sets the type
+    of the outputs that are not given (the storage type by default).
+    returns the dict of outputs.
+    """
+
+    if dtype is None:
+        dtype = storage['dtype']
+
+    inputs = {'solar_angle':solar_angle, 'sw':sw, 'temp':temp, 'rh':rh, 'lw':lw}
+    for name in inputs:
+        if inputs[name] is not None:
+            inputs[name] = np.ravel(inputs[name])
+    do_sw = solar_angle is not None
+    do_lw = temp is not None and rh is not None
+
+    names = []
+    if do_sw:
+        names.append('sw_clearsky')
+        if sw is not None:
+            names.append('sw_diff')
+    if do_lw:
+        names.append('lw_clearsky')
+        if lw is not None:
+            names.append('lw_diff')
+    if len(names) < 1:
+        return {}
+
+    n = len(inputs['solar_angle'] if do_sw else inputs['temp'])
+    if out is None:
+        out = {}
+    for name in names:
+        if name not in out:
+            out[name] = np.empty(n, dtype=dtype)
+    chunk = min(chunk, n) if n > 0 else 1
+    t1 = np.empty(chunk, dtype=dtype)
+    t2 = np.empty(chunk, dtype=dtype)
+    t3 = np.empty(chunk, dtype=dtype)
+    night = np.empty(chunk, dtype=bool)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for i in range(0, n, chunk):
+            j = min(i + chunk, n)
+            k = j - i
+            a1, a2, a3, d = t1[:k], t2[:k], t3[:k], night[:k]
+
+            if do_sw:
+                # sw = 1100 * cos^1.0987 * 0.9472^(1/cos)
+                o = out['sw_clearsky'][i:j]
+                np.multiply(inputs['solar_angle'][i:j], np.pi / 180., out=a1)
+                np.cos(a1, out=a1)
+                # night, a missing (NaN) angle stays missing
+                np.less_equal(a1, 0, out=d)
+                np.log(a1, out=a2)
+                a2 *= 1.0987
+                np.divide(np.log(0.9472), a1, out=a3)
+                a2 += a3
+                np.exp(a2, out=o)
+                o *= 1100
+                o[d] = 0
+                if 'sw_diff' in out:
+                    np.subtract(inputs['sw'][i:j], o, out=out['sw_diff'][i:j])
+
+            if do_lw:
+                # lw = 1.05 * (e/tk)^(1/7) * sigma * tk^4, e = rh * 0.611 * exp(temp / (tk - 35.86))
+                o = out['lw_clearsky'][i:j]
+                temp = inputs['temp'][i:j]
+                np.add(temp, 273.15, out=a1)
+                np.subtract(a1, 35.86, out=a2)
+                np.divide(temp, a2, out=a2)
+                np.log(inputs['rh'][i:j], out=a3)
+                a2 += a3
+                a2 += np.log(0.611)
+                np.log(a1, out=a3)
+                a2 -= a3
+                a2 *= 1./7
+                a3 *= 4
+                a2 += a3
+                np.exp(a2, out=o)
+                o *= 1.05 * 5.67e-8
+                if 'lw_diff' in out:
+                    np.subtract(inputs['lw'][i:j], o, out=out['lw_diff'][i:j])
+
+    return out
+
+
 def lw_clearsky(temp, rh):
     
     # clearsky longwave flux as a function of temperature
-    a = 1.05
-    b = 1./7
-    tk = temp + 273.15
-    esat = 0.611 * np.exp(temp/(tk-35.86))
-    e = esat * rh
-    epsilon = a * np.power(e / tk, b)
-    sigma = 5.67e-8
-    lw = epsilon * sigma * np.power(tk, 4)
-
-    return lw
+    shape = np.shape(temp)
+    return clearsky_batch(temp=temp, rh=rh)['lw_clearsky'].reshape(shape)
 
 
 def sw_clearsky(solar_angle):
 
-    a = 1100
-    b = 1.0987
-    c = 0.9472
-    solar_angle = solar_angle / 180. * np.pi
-    sw = np.abs(a * np.power(np.cos(solar_angle), b) * np.power(c, 1./np.cos(solar_angle)))
-    return sw
+    shape = np.shape(solar_angle)
+    return clearsky_batch(solar_angle=solar_angle)['sw_clearsky'].reshape(shape)
+
+
+def sw_clearsky_time(time, site='SIRTA'):
+
+    # clearsky shortwave flux at epoch times, from the computed solar zenith angle
+    return sw_clearsky(solar_zenith_angle(time, site))
 
 
 def fix_lon(var):
@@ -59,49 +184,123 @@ def fix_lon(var):
     return var2
     
 
-def ceres_nc_read(ceresfile):
-    
-    import netCDF4
-    
-    nc = netCDF4.Dataset(ceresfile)
-    lon = nc.variables['lon'][:]
-    lat = nc.variables['lat'][:]
-    time = nc.variables['time'][:]
-    swup = nc.variables['toa_sw_all_mon'][:]
-    lwup = nc.variables['toa_lw_all_mon'][:]
-    swupclr = nc.variables['toa_sw_clr_mon'][:]
-    lwupclr = nc.variables['toa_lw_clr_mon'][:]
-    nc.close()
-    
-    lon2 = np.zeros_like(lon)
-    lon2[180:] = lon[:180]
-    lon2[:180] = lon[180:]
-    lon = lon2
-    
-    swup = fix_lon(swup)
-    lwup = fix_lon(lwup)
-    swupclr = fix_lon(swupclr)
-    lwupclr = fix_lon(lwupclr)
-    
-    dates = np.array([datetime(2000,3,1) + timedelta(days=int(i)) for i in time])
+class CeresDataset(object):
+    """
+    Lazy access to a CERES EBAF-TOA NetCDF file.
+    The file stays open and only the months a request needs are read.
+    Longitudes are rotated like fix_lon, by reading the two halves of the
+    hyperslab in swapped order rather than copying the whole cube.
+    """
+
+    # short names used in radflux, and the matching EBAF variables
+    ncnames = {'swup':'toa_sw_all_mon', 'lwup':'toa_lw_all_mon',
+               'swupclr':'toa_sw_clr_mon', 'lwupclr':'toa_lw_clr_mon'}
+
+    def __init__(self, ceresfile):
+
+        import netCDF4
+
+        self.filename = ceresfile
+        self.nc = netCDF4.Dataset(ceresfile)
+        lon = self.nc.variables['lon'][:]
+        self.lat = self.nc.variables['lat'][:]
+        self.time = self.nc.variables['time'][:]
+        self.shift = len(lon) // 2
+        self.lon = np.concatenate([lon[self.shift:], lon[:self.shift]])
+        self.shape = (len(self.time), len(self.lat), len(self.lon))
+
+        # integer time index: dates as datetime64, year and month arrays,
+        # and the number of months since 1970-01 to look up periods with searchsorted
+        days = np.floor(np.asarray(self.time, dtype=np.float64)).astype(np.int64)
+        self.dates = np.datetime64('2000-03-01', 'D') + days.astype('timedelta64[D]')
+        self.month_index = self.dates.astype('datetime64[M]').astype(np.int64)
+        self.year = self.month_index // 12 + 1970
+        self.month = self.month_index % 12 + 1
+        self.years = [int(y) for y in np.unique(self.year)]
+        # time of the records in fractional years, for the plots: records can be
+        # monthly or daily, and some can be missing
+        ystart = (self.year - 1970).astype('datetime64[Y]').astype('datetime64[D]')
+        yend = (self.year - 1969).astype('datetime64[Y]').astype('datetime64[D]')
+        origin = np.datetime64('2000-03-01', 'D')
+        elapsed = np.asarray(self.time, dtype=np.float64) - (ystart - origin).astype(np.float64)
+        self.decimal_years = self.year + elapsed / (yend - ystart).astype(np.float64)
+
+    def read(self, name, tstart, tend, out=None):
+        """
+        returns the (tend-tstart, lat, lon) hyperslab of a variable as float32,
+        with rotated longitudes and NaN for missing values.
+        The two halves are read straight into out, allocated if not given.
+        """
+
+        var = self.nc.variables[self.ncnames[name]]
+        # raw values, the fill and out of range values are replaced here
+        # rather than going through a masked array
+        var.set_auto_mask(False)
+        if out is None:
+            out = np.empty((tend - tstart,) + self.shape[1:], dtype=np.float32)
+        n = self.shape[2] - self.shift
+        out[:,:,:n] = var[tstart:tend,:,self.shift:]
+        out[:,:,n:] = var[tstart:tend,:,:self.shift]
+
+        attrs = var.ncattrs()
+        for attr in ('_FillValue', 'missing_value'):
+            if attr in attrs:
+                out[out == np.float32(getattr(var, attr))] = np.nan
+        valid_min, valid_max = getattr(var, 'valid_range', (None, None)) if 'valid_range' in attrs else (None, None)
+        valid_min = getattr(var, 'valid_min', valid_min)
+        valid_max = getattr(var, 'valid_max', valid_max)
+        with np.errstate(invalid='ignore'):
+            if valid_min is not None:
+                out[out < valid_min] = np.nan
+            if valid_max is not None:
+                out[out > valid_max] = np.nan
+        return out
+
+    def window(self, year, month_start, nmonth):
+        """
+        (tstart, tend) record indices of the nmonth months window starting at the
+        first month of year at or after month_start. The window runs into the
+        next year if needed (e.g. DJF) and holds every record of its months,
+        whether they are monthly or daily, missing months are not counted.
+        """
+
+        tstart = np.searchsorted(self.month_index, (year - 1970) * 12 + month_start - 1)
+        if tstart >= len(self.month_index) or self.year[tstart] != year:
+            tstart = np.searchsorted(self.month_index, (year - 1970) * 12)
+        tstart = int(tstart)
+        if tstart >= len(self.month_index):
+            return tstart, tstart
+        return tstart, int(np.searchsorted(self.month_index, self.month_index[tstart] + nmonth))
+
+    def close(self):
+
+        self.nc.close()
+
+
+@profiled()
+def ceres_nc_read(ceresfile, chunk=12):
     
-    lastyear = None
-    years = []
-    for d in dates:
-        if d.year != lastyear:
-            years.append(d.year)
-            lastyear = d.year
-    
-    data = {'time':time, 'lon':lon, 'lat':lat, 'swup':swup, 'lwup':lwup, 'swupclr':swupclr, 'lwupclr':lwupclr, 'dates':dates, 'years':years}
+    ds = CeresDataset(ceresfile)
+    data = {'time':ds.time, 'lon':ds.lon, 'lat':ds.lat, 'dates':ds.dates, 'years':ds.years}
+    for name in ds.ncnames:
+        # read chunk by chunk into the cube, so that no full-size temporary is made
+        data[name] = np.empty(ds.shape, dtype=np.float32)
+        for t in range(0, ds.shape[0], chunk):
+            tend = min(t + chunk, ds.shape[0])
+            ds.read(name, t, tend, out=data[name][t:tend])
+    ds.close()
     return data
     
 
+@profiled()
 def ceres_read(ceresfile):
     
     # mat = matlab.loadmat(ceresfile)
     # lon = mat['lon']
     # lat = mat['lat']
 
+    import h5py
+
     h5file = h5py.File(ceresfile)
     lon = h5file['lon'][:]
     lat = h5file['lat'][:]
@@ -121,118 +320,191 @@ def ceres_read(ceresfile):
     return data
 
 
+def epoch_from_fields(year, month, day, hour=0, minute=0, second=0):
+    """
+    Columnar timestamp builder.
+    Turns integer year, month, day (and optional hour, minute, second) columns
+    into epoch seconds (float64) with vectorized calendar arithmetic.
+    returns the epoch array and a boolean array, False where the fields do not
+    make a valid date (e.g. 31 days in every month).
+    """
+
+    y = np.asarray(year, dtype=np.int64)
+    m = np.asarray(month, dtype=np.int64)
+    d = np.asarray(day, dtype=np.int64)
+    hh = np.asarray(hour, dtype=np.int64)
+    mm = np.asarray(minute, dtype=np.int64)
+    ss = np.asarray(second, dtype=np.int64)
+
+    leap = ((y % 4 == 0) & (y % 100 != 0)) | (y % 400 == 0)
+    mdays = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+    mclip = np.clip(m, 1, 12)
+    ndays = mdays[mclip - 1] + (leap & (mclip == 2))
+    valid = (m >= 1) & (m <= 12) & (d >= 1) & (d <= ndays)
+    valid &= (hh >= 0) & (hh < 24) & (mm >= 0) & (mm < 60) & (ss >= 0) & (ss < 60)
+
+    # days since 1970-01-01 in the proleptic gregorian calendar,
+    # with years starting in March so that leap days come last
+    ya = y - (m <= 2)
+    era = np.floor_divide(ya, 400)
+    yoe = ya - era * 400
+    doy = (153 * ((m + 9) % 12) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    days = era * 146097 + doe - 719468
+
+    epoch = (days * 86400 + hh * 3600 + mm * 60 + ss).astype(np.float64)
+    return epoch, valid
+
+
+@profiled()
+@cached_reader(1)
+def read_1a_file(filename):
+    """
+    Bulk reader for the SIRTA 1a 1-min ASCII files (radflux_1a, meteoz1_1a).
+    The fixed-width YYYY-MM-DDTHH:MM:SSZ column is parsed in one go by numpy,
+    the remaining numeric columns in a single np.fromstring pass.
+    returns the epoch time array (float64 seconds) and a (n, ncol) array
+    holding the columns following the timestamp.
+    """
+
+    with open(filename) as f:
+        lines = [l for l in f if l[:1].isdigit()]
+    # the last line of a file being written can be incomplete
+    if len(lines) > 1 and not lines[-1].endswith('\n') and len(lines[-1].split()) != len(lines[0].split()):
+        lines = lines[:-1]
+    return parse_1a_lines(lines, filename)
+
+
+def parse_1a_lines(lines, filename=''):
+    """
+    epoch times and (n, ncol) values of data lines from a 1a file, see read_1a_file
+    """
+
+    stamps = np.array([l[:19] for l in lines], dtype='S19')
+    time = stamps.astype('datetime64[s]').astype(np.int64).astype(np.float64)
+    if len(lines) < 1:
+        return time, np.zeros((0, 0))
+    x = np.fromstring(''.join([l[20:] for l in lines]), sep=' ')
+    if x.size % len(lines) != 0:
+        raise ValueError('%s: rows do not have the same number of columns' % filename)
+    x = x.reshape(len(lines), -1)
+    return time, x
+
+
+@profiled()
+@cached_reader(1)
+def read_table_file(filename, delimiter=None):
+    """
+    Reader for the yearly ASCII tables (radflux_YYYY, MeteoZ1 1hour, solar angle),
+    returns a 2-D float64 array with NaN for missing values.
+    """
+
+    # headers hold latin-1 characters, numpy only sees bytes this way
+    with open(filename, 'rb') as f:
+        x = np.genfromtxt(f, delimiter=delimiter, missing_values='NaN')
+    return x
+
+
+@profiled()
 def radflux_read(radfile):
 
-    x = np.loadtxt(radfile, converters={0:mdates.datestr2num})
-    # time = np.array(mdates.num2date(x[:,0]), dtype=np.float64)
-    date = mdates.num2date(x[0,0])
-    time = mdates.num2epoch(x[:,0])
-    sangle = x[:,1]
-    totalf = x[:,4]
-    lw = x[:,5]
+    time, x = read_1a_file(radfile)
+    date = datetime.utcfromtimestamp(time[0])
+    # columns are shifted by one compared to the file, the timestamp is not in x
     data = dict()
-    data['solar angle'] = sangle
-    data['clear sky'] = sw_clearsky(sangle)
-    data['total SW flux'] = np.array(totalf, dtype=np.float64)
-    data['LW flux'] = np.array(lw, dtype=np.float64)
+    data['solar angle'] = as_float(x[:,0])
+    data['total SW flux'] = as_float(x[:,3])
+    data['LW flux'] = as_float(x[:,4])
     
     return time, data, date
 
     
+@profiled()
 def radflux_year_read(radfile):
     
-    x = np.genfromtxt(radfile, delimiter=',', missing_values='NaN')
+    x = read_table_file(radfile, ',')
     if x.ndim < 2:
         return
         
-    yy = x[:,0]
-    mm = x[:,1]
-    dd = x[:,2]
-    hh = x[:,3]
-    dates = [datetime(int(y), int(m), int(d), int(h)) for (y, m, d, h) in zip(yy, mm, dd, hh)]
-    date = dates[0].date()
-    dates = mdates.date2num(dates)
-    dates = mdates.num2epoch(dates)
-    solar_angle = x[:,6]
-    sw_global = x[:,9]
-    lw = x[:,10]
-    sw_clearsky = x[:,11]
-    lw_clearsky = x[:,12]
+    time, valid = epoch_from_fields(x[:,0], x[:,1], x[:,2], x[:,3])
+    if not valid.all():
+        x = x[valid]
+        time = time[valid]
+    date = datetime.utcfromtimestamp(time[0]).date()
+    solar_angle = as_float(x[:,6])
+    sw_global = as_float(x[:,9])
+    lw = as_float(x[:,10])
+    sw_clearsky = as_float(x[:,11])
+    lw_clearsky = as_float(x[:,12])
     data = {'solar angle': solar_angle, 'lw_clearsky': lw_clearsky, 'sw_clearsky': sw_clearsky,
-                'total SW flux':sw_global, 'LW flux':lw, 'date':date, 'time':dates}
+                'total SW flux':sw_global, 'LW flux':lw, 'date':date, 'time':time}
     return data
 
 
 
 def find_meteo_file(date, path):
 
-    mask = path + '/meteoz1_*_%04d%02d%02d*.asc' % (date.year, date.month, date.day)
-    files = glob.glob(mask)
-    if len(files) < 1:
-        print mask
-        print files
-        print 'problem ! Could not find meteo files'
-        return None
-    else:
-        meteo_file = files[0]
+    t, valid = epoch_from_fields(date.year, date.month, date.day)
+    meteo_file = get_catalog(path).find_one('meteo_day', t)
+    if meteo_file is None:
+        print 'problem ! Could not find meteo files for ', date, ' in ', path
     return meteo_file
 
 
+@profiled()
 def meteo_read(date, path):
 
     meteo_file = find_meteo_file(date, path)
     if meteo_file is not None:
-        x = np.loadtxt(meteo_file, converters={0:mdates.datestr2num})
-        time = mdates.num2epoch(x[:,0])
-        meteo = {'time':time, 'temperature':x[:,3], 'rh':x[:,4]}
+        time, x = read_1a_file(meteo_file)
+        if len(time) < 1:
+            # a file just created
+            return None
+        meteo = {'time':time, 'temperature':as_float(x[:,2]), 'rh':as_float(x[:,3])}
         return meteo
     else:
         return None
 
 
+@profiled()
 def meteo_year_read(year, path):
 
     print 'Reading meteo data for ', year
-    meteo_file = path + '/MeteoZ1_SIRTA_Z1_1hour%04d.txt' % (year)
+    t, valid = epoch_from_fields(year, 1, 1)
+    meteo_file = get_catalog(path).find_one('meteo_year', t)
+    if meteo_file is None:
+        print 'problem ! Could not find meteo file for ', year, ' in ', path
+        return None
     print 'Trying ', meteo_file
-    x = np.loadtxt(meteo_file, delimiter=',')
-    y = np.int32(x[:,0])
-    m = np.int32(x[:,1])
-    d = np.int32(x[:,2])
-    hh = np.int32(x[:,3])
-    mm = np.int32(x[:,4])
-    temperature = x[:,5]
-    matemperature = np.ma.masked_where(temperature < -100, temperature)
-    temperature[temperature < -100] = np.nan
+    x = read_table_file(meteo_file, ',')
+    time, valid = epoch_from_fields(x[:,0], x[:,1], x[:,2], x[:,3], x[:,4])
+    if not valid.all():
+        x = x[valid]
+        time = time[valid]
+    # -999.99 marks missing values
+    temperature = as_float(x[:,5])
+    with np.errstate(invalid='ignore'):
+        temperature[temperature < -100] = np.nan
+    rh = as_float(x[:,6])
+    with np.errstate(invalid='ignore'):
+        rh[rh < -100] = np.nan
     
-    time = []
-    for i in np.r_[0:len(y)]:
-        time.append(datetime(y[i], m[i], d[i], hh[i], mm[i]))
-    epochtime = mdates.num2epoch(mdates.date2num(time))
-
-    meteo = {'time':time, 'Temperature [C]':matemperature, 'epochtime':epochtime, 'temperature':temperature}
+    meteo = {'time':time, 'epochtime':time, 'temperature':temperature, 'rh':rh}
 
     return meteo
 
 
-def solar_year_read(year):
-    print 'Reading solar data'
-    solar_file = 'data/solar_angle_SIRTA_year.txt'
-    x = np.loadtxt(solar_file)
-    m = np.int32(x[:,0])
-    d = np.int32(x[:,1])
-    hh = np.int32(x[:,2]) - 1
-    time = []
-    angle = []
-    for i in np.r_[0:len(m)]:
-        # the solar angle file gives 31 days to every month.
-        # great.
-        try:
-            date = datetime(year, m[i], d[i], hh[i])
-        except ValueError:
-            continue
-        time.append(date)
-        angle.append(x[i,3])                
+def solar_year_read(year, path='data', site='SIRTA'):
+    '''
+    hourly solar zenith angles for a year, computed for the site.
+    path is not used anymore, the lookup table is not needed.
+    '''
+
+    print 'Computing solar data'
+    t0, valid = epoch_from_fields(year, 1, 1)
+    t1, valid = epoch_from_fields(year + 1, 1, 1)
+    time = np.arange(t0, t1, 3600.)
+    angle = solar_zenith_angle(time, site)
 
     solar = {'time':time, 'Solar Angle [deg]':angle}
     return solar
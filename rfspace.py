@@ -9,6 +9,7 @@ Created by Vincent Noel - LMD/CNRS on 2011-11-10.
 import numpy as np
 
 import os
+import argparse
 
 import chaco.api as chaco
 
@@ -22,7 +23,9 @@ from traitsui.menu import MenuBar, Menu, Action, CloseAction, Separator
 
 from enable.api import ComponentEditor
 
-from radflux_utils import ceres_nc_read, coastlines_read
+from radflux_api import CeresDataset, load_coastlines, DerivedFields, CERES_FORMULAS, load_climatology, Reductions
+from radflux_api import color_range, map_title
+from radflux_profile import stage, profiled, set_profiling, time_draws, show_performance
 
 
 class RFMaps(HasTraits):
@@ -34,6 +37,9 @@ class RFMaps(HasTraits):
     nmonth = Range(value=3, low=1, high=12)
     year_list = List([])
     show_year = Enum(values='year_list')
+    plot_mode = Enum('Map', 'Global mean', 'Zonal mean', 'Hovmoller')
+    # window mean, multi-year climatology of the window months, or anomaly of the window
+    statistic = Enum('Mean', 'Climatology', 'Anomaly')
     data_selector = Enum('Shortwave Upgoing Radiation Flux (measurements)', 
                          'Shortwave Clear-Sky Upgoing Radiation Flux (model)', 
                          'Shortwave, model - measurements',
@@ -53,11 +59,15 @@ class RFMaps(HasTraits):
             HGroup(
                 Item('show_year', label='Year'),
                 Item('data_selector', springy=True),
+                Item('plot_mode', label='Plot'),
+                Item('statistic', label='Show', visible_when='plot_mode == "Map"'),
                 springy=True,
                 padding=5
             ),
             HGroup(
-                UItem('map_container', editor=ComponentEditor(), width=800, height=300),
+                UItem('map_container', editor=ComponentEditor(), width=800, height=300, visible_when='plot_mode == "Map"'),
+                UItem('series_plot', editor=ComponentEditor(), width=800, height=300, visible_when='plot_mode in ("Global mean", "Zonal mean")'),
+                UItem('hov_container', editor=ComponentEditor(), width=800, height=300, visible_when='plot_mode == "Hovmoller"'),
             ),
             # Item('yearlist'),
             Item('month_start', label='Start Month'),
@@ -82,6 +92,7 @@ class RFMaps(HasTraits):
                 name='File',
             ),
             Menu(
+                Action(name='Performance...', action='performance'),
                 Action(name='About', action='about'),
                 name='Help'
             )
@@ -95,37 +106,33 @@ class RFMaps(HasTraits):
         self.update_period()
         self.set_data_in_plot()
     
+    @profiled('RFMaps.update_period')
     def update_period(self):
 
-        y = self.show_year
-        ms = self.month_start
-        me = self.month_start + self.nmonth
-        idx = [1 if (d.year == y and d.month >= ms and d.month < me) else 0 for d in self.dates]
-        idx = (np.array(idx) > 0)
-
-        months_idx = np.arange(len(self.dates))[idx]        
-
-        self.tstart = np.min(months_idx)
-        self.tend = np.max(months_idx) + 1
+        self.tstart, self.tend = self.data.window(self.show_year, self.month_start, self.nmonth)
                 
     def _data_selector_changed(self):
 
         self.update_plot()
     
+    def _plot_mode_changed(self):
+
+        self.update_plot()
+    
+    def _statistic_changed(self):
+
+        self.update_plot()
+    
     def _show_year_changed(self):
 
         self.update_plot()
             
     def _month_start_changed(self):
 
-        if (self.month_start + self.nmonth) > 13:
-            self.nmonth = 13 - self.month_start
         self.update_plot()
         
     def _nmonth_changed(self):
 
-        if (self.month_start + self.nmonth) > 13:
-            self.month_start = 13 - self.nmonth
         self.update_plot()
         
     def _open_file_button_fired(self):
@@ -136,38 +143,57 @@ class RFMaps(HasTraits):
             
         self.handler.open_file(None)
         
-    def set_data_from_file(self, filedata):
-
-        self.time = filedata['time']
-        self.dates = filedata['dates']
-        self.lon = filedata['lon']
-        self.lat = filedata['lat']
-        
-        self.data = {'Shortwave Upgoing Radiation Flux (measurements)':filedata['swup'], 
-                     'Shortwave Clear-Sky Upgoing Radiation Flux (model)':filedata['swupclr'],
-                     'Shortwave, model - measurements':filedata['swupclr'] - filedata['swup'],
-                     'Longwave Upgoing Radiation Flux (measurements)':filedata['lwup'],
-                     'Longwave Clear-Sky Upgoing Radiation Flux (model)':filedata['lwupclr'],
-                     'Longwave, model - measurements':filedata['lwupclr'] - filedata['lwup'],
-                     'Cloud Radiative Impact (LW difference + SW difference)': filedata['swupclr'] - filedata['swup'] + filedata['lwupclr'] - filedata['lwup'],
-                     }
+    # data_selector entries as formulas over the CERES base fields
+    formulas = CERES_FORMULAS
+
+    @profiled('RFMaps.set_data_from_file')
+    def set_data_from_file(self, dataset):
+
+        self.time = dataset.time
+        self.dates = dataset.dates
+        self.lon = dataset.lon
+        self.lat = dataset.lat
+        
+        self.data = dataset
+        self.month_index = dataset.month_index
+        self.year = dataset.year
+        self.months = dataset.month
+        self.climatology = None
+        self.decimal_years = dataset.decimal_years
+        self.fields = DerivedFields(dataset, self.formulas)
+        with stage('prefix sums'):
+            self.fields.build_prefix_sums()
+        self.reductions = Reductions(dataset, self.fields.formulas)
                     
-        self.year_list = filedata['years']
+        self.year_list = dataset.years
         self.update_period()
                 
+    @profiled('RFMaps.open_ceres_data')
     def open_ceres_data(self, rf_file):
         
-        filedata = ceres_nc_read(rf_file)
-        if filedata is not None:
-            self.coastlon, self.coastlat = coastlines_read(os.path.dirname(rf_file))
-            self.set_data_from_file(filedata)
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        with stage('CeresDataset', file=rf_file):
+            dataset = CeresDataset(rf_file)
+        with stage('load_coastlines'):
+            self.coastlines = load_coastlines(os.path.dirname(rf_file))
+        self.set_data_from_file(dataset)
                 
+    @profiled('RFMaps.save_image')
     def save_image(self, imagefile):
 
         print 'saving ', imagefile
-        window_size = self.map_container.outer_bounds
+        if self.plot_mode == 'Map':
+            component = self.map_container
+        elif self.plot_mode == 'Hovmoller':
+            component = self.hov_container
+        else:
+            component = self.series_plot
+        window_size = component.outer_bounds
         gc = chaco.PlotGraphicsContext(window_size)
-        gc.render_component(self.map_container)
+        with stage('render image'):
+            gc.render_component(component)
         gc.save(imagefile)
         
     def set_data_in_plot(self):
@@ -175,38 +201,99 @@ class RFMaps(HasTraits):
         if self.data is None or self.map_container is None:
             return
             
-        selected_data = self.data[self.data_selector]
-        imagedata = np.mean(selected_data[self.tstart:self.tend,:,:], axis=0)
+        if self.plot_mode == 'Map':
+            self.set_map_in_plot()
+        elif self.plot_mode == 'Hovmoller':
+            self.set_hovmoller_in_plot()
+        else:
+            self.set_series_in_plot()
+        
+    @profiled('RFMaps.set_map_in_plot')
+    def set_map_in_plot(self):
+        
+        if self.statistic == 'Mean':
+            imagedata = self.fields.window_mean(self.data_selector, self.tstart, self.tend)
+        else:
+            if self.climatology is None:
+                with stage('load_climatology'):
+                    self.climatology = load_climatology(self.data.filename, sorted(self.data.ncnames))
+            coefs = self.fields.formulas[self.data_selector]
+            imagedata = self.climatology.window_mean(coefs, self.months[self.tstart:self.tend])
+            if self.statistic == 'Anomaly':
+                imagedata = self.fields.window_mean(self.data_selector, self.tstart, self.tend) - imagedata
+        self.show_map(imagedata)
+
+    def map_title(self):
+
+        return map_title(self.statistic, self.nmonth, self.show_year, self.month_start, self.year_list)
+
+    def show_map(self, imagedata):
+        '''
+        puts a map of the current data_selector and statistic in the map plot
+        '''
+
         self.rfdata.set_data('image', imagedata)
-        self.rfdata.set_data('coastlon', self.coastlon)
-        self.rfdata.set_data('coastlat', self.coastlat)
+        self.update_coastlines()
 
-        self.plot_title = 'CERES RF DATA %d months average since %04d-%02d-01' % (self.nmonth, self.show_year, self.month_start)
+        self.plot_title = self.map_title()
         self.map_plot.title = self.plot_title
         
-        if 'model - measurements' in self.data_selector:
-            cmin, cmax = -80, 80
-        elif self.data_selector.startswith('Shortwave'):
-            cmin, cmax = 0, 250
-        elif self.data_selector.startswith('Longwave'):
-            cmin, cmax = 0, 400
+        self.set_colors(self.map_img, self.map_colorbar, self.statistic == 'Anomaly')
+            
+    @profiled('RFMaps.set_hovmoller_in_plot')
+    def set_hovmoller_in_plot(self):
+        
+        hovdata = self.reductions.hovmoller(self.data_selector)
+        self.hovdata.set_data('image', hovdata.T)
+        # record edges in decimal years, halfway between records
+        x = self.decimal_years
+        step = np.diff(x) if len(x) > 1 else np.array([1/12.])
+        xedges = np.r_[x[0] - 0.5 * step[0], 0.5 * (x[1:] + x[:-1]), x[-1] + 0.5 * step[-1]]
+        yedges = np.r_[self.lat[0] - 0.5 * (self.lat[1] - self.lat[0]), 0.5 * (self.lat[1:] + self.lat[:-1]), self.lat[-1] + 0.5 * (self.lat[-1] - self.lat[-2])]
+        self.hov_img.index.set_data(xedges, yedges)
+        
+        self.plot_title = 'CERES RF DATA zonal means %d-%d' % (self.year_list[0], self.year_list[-1])
+        self.hov_plot.title = self.plot_title
+        self.hov_plot.x_axis.title = 'Year'
+        self.hov_plot.y_axis.title = 'Latitude'
+        self.set_colors(self.hov_img, self.hov_colorbar, False)
+        
+    @profiled('RFMaps.set_series_in_plot')
+    def set_series_in_plot(self):
+        
+        if self.plot_mode == 'Global mean':
+            x = self.decimal_years
+            y = self.reductions.global_mean(self.data_selector)
+            self.plot_title = 'CERES RF DATA area-weighted global mean'
+            self.series_plot.x_axis.title = 'Year'
         else:
-            cmin, cmax = -50, 50
-        self.map_img.color_mapper.range.set_bounds(cmin,cmax)
+            x = self.lat
+            y = self.reductions.zonal_mean(self.data_selector, self.tstart, self.tend)
+            self.plot_title = 'CERES RF DATA %d months zonal mean since %04d-%02d-01' % (self.nmonth, self.show_year, self.month_start)
+            self.series_plot.x_axis.title = 'Latitude'
+        self.seriesdata.set_data('x', np.asarray(x, dtype=np.float64))
+        self.seriesdata.set_data('y', np.asarray(y, dtype=np.float64))
+        self.series_plot.title = self.plot_title
+        self.series_plot.y_axis.title = self.data_selector + ' (W/m2)'
+        
+    def set_colors(self, img, colorbar, anomaly):
+        
+        cmin, cmax = color_range(self.data_selector, anomaly)
+        img.color_mapper.range.set_bounds(cmin,cmax)
         
-        self.map_colorbar._axis.title = self.data_selector
+        colorbar._axis.title = self.data_selector
         
-        if 'model - measurements' in self.data_selector or 'Impact' in self.data_selector:
-            self.map_img.color_mapper = chaco.RdBu(self.map_img.color_mapper.range)
-            self.map_img.color_mapper.reverse_colormap()
+        if 'model - measurements' in self.data_selector or 'Impact' in self.data_selector or anomaly:
+            img.color_mapper = chaco.RdBu(img.color_mapper.range)
+            img.color_mapper.reverse_colormap()
         else:
-            self.map_img.color_mapper = chaco.jet(self.map_img.color_mapper.range)
+            img.color_mapper = chaco.jet(img.color_mapper.range)
             
-    def init_map(self, arrayplotdata):
+    def init_map(self, arrayplotdata, xbounds=(-180,180), ybounds=(-90,90)):
         
         map_plot = chaco.Plot(arrayplotdata, padding=40)
         map_plot.title = self.plot_title
-        map_img = map_plot.img_plot('image', colormap=chaco.jet, xbounds=(-180,180), ybounds=(-90,90))[0]
+        map_img = map_plot.img_plot('image', colormap=chaco.jet, xbounds=xbounds, ybounds=ybounds)[0]
         
         map_colorbar = chaco.ColorBar(orientation='v',
                                     resizable='v',
@@ -223,14 +310,36 @@ class RFMaps(HasTraits):
         
         return map_container, map_plot, map_img, map_colorbar
         
+    def init_series(self, arrayplotdata):
+        
+        series_plot = chaco.Plot(arrayplotdata, padding=50)
+        series_plot.plot(('x', 'y'), color='darkblue')
+        series_plot.title = self.plot_title
+        return series_plot
+        
     def init_coastlines_on_map(self, map_plot):
         
-        coastlines_plot = map_plot.plot(('coastlon', 'coastlat'), type='scatter', marker_size=0.1)
+        # polylines separated by NaN
+        coastlines_plot = map_plot.plot(('coastlon', 'coastlat'), type='line', color='black', line_width=0.5)
         return coastlines_plot
+
+    def update_coastlines(self):
+
+        if self.coastlines is None:
+            return
+
+        # a trait handler, so timed with a stage: a decorator would hide its arguments from traits
+        with stage('RFMaps.update_coastlines'):
+            # the level of detail follows the map extent and its size in pixels
+            extent = self.map_plot.index_range.high - self.map_plot.index_range.low
+            lon, lat = self.coastlines.lines(extent, self.map_plot.width)
+            self.rfdata.set_data('coastlon', lon)
+            self.rfdata.set_data('coastlat', lat)
         
     def __init__(self, file_to_open=None):
 
         self.data = None
+        self.coastlines = None
 
         self.rfdata = chaco.ArrayPlotData()
         fakedata = np.random.rand(200,200)
@@ -246,6 +355,24 @@ class RFMaps(HasTraits):
         self.map_img = img
         self.map_colorbar = colorbar
         self.coastlines_plot = coastlines_plot
+        self.map_plot.on_trait_change(self.update_coastlines, 'bounds')
+        
+        self.hovdata = chaco.ArrayPlotData()
+        self.hovdata.set_data('image', fakedata)
+        container, plot, img, colorbar = self.init_map(self.hovdata, xbounds=(0,1))
+        self.hov_container = container
+        self.hov_plot = plot
+        self.hov_img = img
+        self.hov_colorbar = colorbar
+        
+        self.seriesdata = chaco.ArrayPlotData()
+        self.seriesdata.set_data('x', [])
+        self.seriesdata.set_data('y', [])
+        self.series_plot = self.init_series(self.seriesdata)
+
+        time_draws(self.map_container, 'map')
+        time_draws(self.hov_container, 'hovmoller')
+        time_draws(self.series_plot, 'series')
                 
         if file_to_open is not None:
             self.open_ceres_data(file_to_open)
@@ -289,6 +416,10 @@ class RFController(Handler):
         if fd.open() == OK:
             self.view.save_image(fd.path)
             
+    def performance(self, ui_info):
+
+        show_performance(parent=ui_info.ui.control)
+
     def about(self, ui_info):
         text = ['rfspace.py', 'VNoel 2011-2014 CNRS', 'CERES EBAF-TOA map viewer', 'SIRTA']
         dlg = AboutDialog(parent=ui_info.ui.control, additions=text)
@@ -296,6 +427,13 @@ class RFController(Handler):
 
 
 def main():
+
+    parser = argparse.ArgumentParser(description='CERES EBAF-TOA map viewer')
+    parser.add_argument('--profile', nargs='?', const='-', metavar='FILE',
+                        help='time the load, compute and render stages, records go to stderr or FILE')
+    args = parser.parse_args()
+    if args.profile is not None:
+        set_profiling(True, args.profile)
     
     # rfmap = RFMaps(file_to_open='data/CERES_EBAF_TOA_Terra_Edition1A_200003-200510.mat')
     rfmap = RFMaps()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+rfspace_batch.py
+
+Headless export of rfspace maps for every combination of years, start months,
+window lengths and variables, e.g. a seasonal atlas.
+
+The CERES file is read once: the prefix sums of the base fields make every
+window mean the difference of two slices, and the base window means are
+shared between the variables built on them. Maps are drawn with matplotlib
+(no GUI toolkit is needed) by a pool of worker processes. Every map is
+recorded in manifest.json in the output directory, with its spec and the
+modification times of the CERES and climatology files it comes from; a PNG
+is only rendered again if one of them changed. Climatology maps do not depend on
+the year, they are rendered once per start month and window length.
+
+e.g.
+    rfspace_batch.py -o atlas --months 3,6,9,12 --nmonths 3 data/CERES_EBAF-TOA_Ed2.8_Subset_200301-201212.nc
+"""
+
+import os
+import re
+import json
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from radflux_api import CeresDataset, load_coastlines, DerivedFields, CERES_FORMULAS, load_climatology, climatology_file
+from radflux_api import color_range, map_title, set_profiling
+from radflux_profile import stage
+
+
+MAP_SIZE = (900, 350)
+
+# worker state, set up once per process by init_renderer
+renderer = {}
+
+
+def slug(formula):
+    '''
+    file name friendly form of a formula, e.g. swupclr_minus_swup
+    '''
+
+    name = formula.replace('-', ' minus ').replace('+', ' plus ')
+    return re.sub(r'[^A-Za-z0-9.]+', '_', name).strip('_')
+
+
+def parse_list(text):
+    '''
+    '1,3,6' or '2003-2012' or a mix of both, as a list of int
+    '''
+
+    values = []
+    for part in text.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            values.extend(range(int(first), int(last) + 1))
+        else:
+            values.append(int(part))
+    return values
+
+
+def map_specs(dataset, selectors, formulas, years, months, nmonths, statistic, outdir):
+    '''
+    list of the maps to export, windows first so that the variables of a
+    window follow each other and share its base means
+    '''
+
+    windows = []
+    for year in years:
+        for month_start in months:
+            for nmonth in nmonths:
+                tstart, tend = dataset.window(year, month_start, nmonth)
+                if tend > tstart:
+                    windows.append((year, month_start, nmonth, tstart, tend))
+
+    if statistic == 'Climatology':
+        # climatology maps do not depend on the year, there is one per start
+        # month and length, from the longest of its windows (the last ones can be cut)
+        longest = {}
+        for window in windows:
+            key = window[1:3]
+            if key not in longest or window[4] - window[3] > longest[key][4] - longest[key][3]:
+                longest[key] = window
+        windows = [window for window in windows if longest[window[1:3]] is window]
+
+    specs = []
+    for year, month_start, nmonth, tstart, tend in windows:
+        for selector in selectors:
+            if statistic == 'Climatology':
+                name = '%s_climatology_%02d_%02dm.png' % (slug(formulas[selector]), month_start, nmonth)
+            else:
+                name = '%s_%s_%04d_%02d_%02dm.png' % (slug(formulas[selector]), statistic.lower(), year, month_start, nmonth)
+            specs.append({'file': os.path.join(outdir, name), 'variable': selector,
+                          'formula': formulas[selector], 'statistic': statistic,
+                          'year': year, 'month_start': month_start, 'nmonth': nmonth,
+                          'first_month': str(dataset.dates[tstart])[:7],
+                          'last_month': str(dataset.dates[tend - 1])[:7],
+                          'tstart': tstart, 'tend': tend})
+    return specs
+
+
+# what a map is made of, beside its source files
+SPEC_KEYS = ('variable', 'formula', 'statistic', 'year', 'month_start', 'nmonth',
+             'tstart', 'tend', 'first_month', 'last_month')
+
+
+def map_sources(ceresfile, statistic):
+    '''
+    modification times of the files the maps are computed from
+    '''
+
+    sources = {'ceres': os.path.getmtime(ceresfile)}
+    if statistic != 'Mean':
+        clim = climatology_file(ceresfile)
+        sources['climatology'] = os.path.getmtime(clim) if os.path.isfile(clim) else None
+    return sources
+
+
+def up_to_date(spec, entry, sources):
+    '''
+    a map is up to date if its file exists and its manifest entry was
+    rendered from the same spec and the same source files
+    '''
+
+    if entry is None or not os.path.isfile(spec['file']):
+        return False
+    if entry.get('status') not in ('rendered', 'up to date'):
+        return False
+    if any([entry.get(key) != spec[key] for key in SPEC_KEYS]):
+        return False
+    return entry.get('sources') == sources
+
+
+def map_image(fields, climatology, months, spec):
+    '''
+    the map of a spec, like RFMaps.set_map_in_plot
+    '''
+
+    tstart, tend = spec['tstart'], spec['tend']
+    if spec['statistic'] == 'Mean':
+        image = fields.window_mean(spec['variable'], tstart, tend)
+    else:
+        image = climatology.window_mean(fields.formulas[spec['variable']], months[tstart:tend])
+        if spec['statistic'] == 'Anomaly':
+            image = fields.window_mean(spec['variable'], tstart, tend) - image
+    return np.asarray(image, dtype=np.float32)
+
+
+def init_renderer(path, years, size):
+
+    renderer['coastlines'] = load_coastlines(path)
+    renderer['years'] = years
+    renderer['size'] = size
+
+
+def draw_map(image, spec, filename):
+    '''
+    draws a map like the rfspace map plot, with matplotlib only
+    '''
+
+    # no pyplot, so that no GUI backend is ever loaded
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    dpi = 100.
+    width, height = renderer['size']
+    fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    cmin, cmax = color_range(spec['variable'], spec['statistic'] == 'Anomaly')
+    img = ax.imshow(image, extent=(-180, 180, -90, 90), origin='lower', cmap='jet', vmin=cmin, vmax=cmax,
+                    aspect='auto', interpolation='nearest')
+    lon, lat = renderer['coastlines'].lines(360., width)
+    ax.plot(lon, lat, color='black', linewidth=0.5)
+    ax.set_xlim(-180, 180)
+    ax.set_ylim(-90, 90)
+    ax.set_title(map_title(spec['statistic'], spec['nmonth'], spec['year'], spec['month_start'], renderer['years']), fontsize=10)
+    fig.colorbar(img, ax=ax).set_label(spec['variable'], fontsize=8)
+    fig.savefig(filename, dpi=dpi, format='png')
+
+
+def render_map(job):
+    '''
+    draws a map to its PNG file, returns (spec, seconds, error)
+    '''
+
+    image, spec = job
+    t0 = time.time()
+    try:
+        # an interrupted export must not leave a file that looks up to date
+        partname = spec['file'][:-len('.png')] + '.part.png'
+        with stage('render image', file=spec['file']):
+            draw_map(image, spec, partname)
+        os.rename(partname, spec['file'])
+    except Exception as e:
+        return spec, time.time() - t0, str(e)
+    return spec, time.time() - t0, None
+
+
+def read_manifest(outdir):
+    '''
+    entries of outdir/manifest.json by file name, empty if there is none
+    '''
+
+    manifest_file = os.path.join(outdir, 'manifest.json')
+    entries = {}
+    if os.path.isfile(manifest_file):
+        try:
+            with open(manifest_file) as f:
+                for entry in json.load(f)['maps']:
+                    entries[entry['file']] = entry
+        except (IOError, ValueError, KeyError):
+            pass
+    return entries
+
+
+def write_manifest(outdir, ceresfile, specs):
+    '''
+    records the maps in outdir/manifest.json, keeping the entries of
+    previous exports to other files
+    '''
+
+    manifest_file = os.path.join(outdir, 'manifest.json')
+    entries = read_manifest(outdir)
+    for spec in specs:
+        entry = dict(spec)
+        entry['file'] = os.path.basename(spec['file'])
+        entries[entry['file']] = entry
+
+    manifest = {'source': os.path.abspath(ceresfile), 'source_mtime': os.path.getmtime(ceresfile),
+                'maps': [entries[name] for name in sorted(entries)]}
+    with open(manifest_file + '.part', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(manifest_file + '.part', manifest_file)
+    return manifest_file
+
+
+def export_maps(ceresfile, outdir, selectors, formulas, years=None, months=None, nmonths=(3,),
+                statistic='Mean', processes=None, size=MAP_SIZE, force=False):
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    t0 = time.time()
+    dataset = CeresDataset(ceresfile)
+    years = dataset.years if years is None else [y for y in years if y in dataset.years]
+    months = range(1, 13) if months is None else months
+    specs = map_specs(dataset, selectors, formulas, years, months, nmonths, statistic, outdir)
+
+    entries = read_manifest(outdir)
+    sources = map_sources(ceresfile, statistic)
+    todo = []
+    for spec in specs:
+        spec['sources'] = sources
+        if not force and up_to_date(spec, entries.get(os.path.basename(spec['file'])), sources):
+            spec['status'] = 'up to date'
+        else:
+            todo.append(spec)
+    print '%d maps, %d up to date' % (len(specs), len(specs) - len(todo))
+
+    nrendered = 0
+    if len(todo) > 0:
+        fields = DerivedFields(dataset, dict([(s, formulas[s]) for s in selectors]))
+        fields.build_prefix_sums()
+        climatology = None
+        if statistic != 'Mean':
+            climatology = load_climatology(ceresfile, sorted(dataset.ncnames))
+            # the climatology file may just have been written
+            for spec in todo:
+                spec['sources'] = map_sources(ceresfile, statistic)
+        print 'prefix sums ready in %.1f s' % (time.time() - t0)
+
+        # simplified once here, the workers then load the levels from the cache
+        load_coastlines(os.path.dirname(ceresfile))
+        initargs = (os.path.dirname(ceresfile), dataset.years, size)
+        if processes == 1:
+            init_renderer(*initargs)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes, init_renderer, initargs)
+
+        # maps are computed a group at a time, so that the images waiting
+        # for a worker do not pile up in memory
+        group = 8 * (processes or multiprocessing.cpu_count())
+        # results come back pickled, statuses go to the original specs
+        by_file = dict([(spec['file'], spec) for spec in todo])
+        try:
+            for i in range(0, len(todo), group):
+                jobs = [(map_image(fields, climatology, dataset.month, spec), spec) for spec in todo[i:i+group]]
+                results = pool.imap_unordered(render_map, jobs) if pool is not None else (render_map(job) for job in jobs)
+                for spec, seconds, error in results:
+                    original = by_file[spec['file']]
+                    if error is not None:
+                        original['status'] = 'failed: ' + error
+                        print 'Failed ', spec['file'], ':', error
+                    else:
+                        original['status'] = 'rendered'
+                        nrendered += 1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    dataset.close()
+    manifest_file = write_manifest(outdir, ceresfile, specs)
+    elapsed = time.time() - t0
+    print '%d maps rendered in %.1f s: %.2f maps/s, manifest in %s' % (nrendered, elapsed, nrendered / max(elapsed, 1e-9), manifest_file)
+    return specs
+
+
+def main():
+
+    formulas = CERES_FORMULAS
+    selectors = sorted(formulas)
+    names = dict([(slug(formulas[s]), s) for s in selectors])
+
+    parser = argparse.ArgumentParser(description='Export rfspace maps to PNG files, without a window')
+    parser.add_argument('ceresfile', help='CERES EBAF-TOA NetCDF file')
+    parser.add_argument('-o', '--outdir', default='maps', help='output directory')
+    parser.add_argument('--years', help='e.g. 2003-2012 or 2005,2008 (default: all)')
+    parser.add_argument('--months', help='start months, e.g. 3,6,9,12 (default: 1-12)')
+    parser.add_argument('--nmonths', default='3', help='window lengths in months, e.g. 1,3,12 (default: 3)')
+    parser.add_argument('--variables', help='among ' + ', '.join(sorted(names)) + ' (default: all)')
+    parser.add_argument('--statistic', default='Mean', choices=['Mean', 'Climatology', 'Anomaly'])
+    parser.add_argument('-j', '--processes', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--force', action='store_true', help='render maps that are up to date too')
+    parser.add_argument('--profile', nargs='?', const='-', metavar='FILE',
+                        help='time the load, compute and render stages, records go to stderr or FILE')
+    args = parser.parse_args()
+    # workers inherit the setting
+    if args.profile is not None:
+        set_profiling(True, args.profile)
+
+    if args.variables is not None:
+        unknown = [v for v in args.variables.split(',') if v not in names]
+        if len(unknown) > 0:
+            parser.error('unknown variables: ' + ', '.join(unknown))
+        selectors = [names[v] for v in args.variables.split(',')]
+    years = parse_list(args.years) if args.years else None
+    months = parse_list(args.months) if args.months else None
+
+    export_maps(args.ceresfile, args.outdir, selectors, formulas, years=years, months=months,
+                nmonths=parse_list(args.nmonths), statistic=args.statistic, processes=args.processes,
+                force=args.force)
+
+
+if __name__ == '__main__':
+    main()
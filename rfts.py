@@ -9,15 +9,16 @@ Created by Vincent Noel - LMD/CNRS on 2011-11-08.
 import numpy as np
 
 import os
-import tempfile
-from reportlab.pdfgen import canvas
+import argparse
+from datetime import timedelta
 
 import chaco.api as chaco
 from chaco.tools.api import ZoomTool, PanTool
 
-from pyface.api import OK, FileDialog, AboutDialog, MessageDialog
+from pyface.api import OK, FileDialog, DirectoryDialog, AboutDialog, MessageDialog
+from pyface.timer.api import Timer
 
-from traits.api import HasTraits, Instance, Bool, Str, Button, Enum
+from traits.api import HasTraits, Instance, Bool, Str, Button, Enum, Date
 from traitsui.api import View, VGroup, HGroup, Item, UItem, Spring, Handler
 from traitsui.menu import MenuBar, Menu, Action, CloseAction, Separator
 
@@ -26,7 +27,26 @@ from enable.api import ComponentEditor
 from chaco.scales.api import CalendarScaleSystem
 from chaco.scales_tick_generator import ScalesTickGenerator
 
-from radflux_utils import radflux_year_read, meteo_year_read, radflux_read, meteo_read, sw_clearsky, lw_clearsky
+from radflux_api import radflux_year_read, meteo_year_read, radflux_read, meteo_read, clearsky_batch
+from radflux_api import align, load_station_series, add_clearsky, Envelope, aggregate
+from radflux_api import FollowReader, GrowableArray, find_meteo_file, storage
+from radflux_profile import stage, profiled, set_profiling, time_draws, show_performance
+
+def component_image(component):
+    '''
+    renders a chaco component in memory, as a PIL RGB image of its outer bounds
+    '''
+
+    from PIL import Image
+
+    size = [int(s) for s in component.outer_bounds]
+    gc = chaco.PlotGraphicsContext(size)
+    gc.render_component(component)
+    pixels = gc.bmp_array
+    if gc.format().startswith('bgra'):
+        pixels = pixels[:,:,[2,1,0,3]]
+    return Image.fromarray(np.ascontiguousarray(pixels), 'RGBA').convert('RGB')
+
 
 def add_date_axis(plot):
     
@@ -52,6 +72,11 @@ class RFTimeSeries(HasTraits):
     data_to_plot = 'NA'
     clearsky_name = 'NA'
     diff_name = 'NA'
+    # series with a level-of-detail envelope
+    lod_names = ['total SW flux', 'LW flux', 'sw_clearsky', 'lw_clearsky', 'sw_diff', 'lw_diff', 'solar angle']
+    # display resolutions, and the matching radflux_aggregate resolutions
+    resolution = Enum('samples', 'daily means', 'monthly means', 'diurnal cycles')
+    resolutions = {'daily means': 'daily', 'monthly means': 'monthly', 'diurnal cycles': 'diurnal'}
     
     rfcontainer = Instance(chaco.Plot)
     sacontainer = Instance(chaco.Plot)
@@ -59,6 +84,10 @@ class RFTimeSeries(HasTraits):
     
     show_clearsky = Bool(False)
     show_diff = Bool(False)
+    # live monitoring of a day file being written
+    follow = Bool(False)
+    can_follow = Bool(False)
+    follow_interval = 10
     reset_zoom_button = Button('Reset Zoom')
     open_file_button = Button('Open Data File...')
 
@@ -69,8 +98,10 @@ class RFTimeSeries(HasTraits):
             UItem('rfcontainer', editor=ComponentEditor()),
             HGroup(
                 Item('data_selector'),
+                Item('resolution'),
                 Item('show_clearsky', label='Show Clear-Sky Model'),
                 Item('show_diff', label='Show difference'),
+                Item('follow', label='Follow file', visible_when='can_follow'),
                 UItem('reset_zoom_button'),
                 padding=10
             ),
@@ -94,10 +125,12 @@ class RFTimeSeries(HasTraits):
                 CloseAction,
                 Separator(),
                 Action(name='Open data file...', action='open_file'),
+                Action(name='Open date range...', action='open_range'),
                 Action(name='Save Plot...', action='save_plot', enabled_when='plot_title != ""'),
                 name='File',
             ),
             Menu(
+                Action(name='Performance...', action='performance'),
                 Action(name='About', action='about'),
                 name='Help'
             )
@@ -116,18 +149,21 @@ class RFTimeSeries(HasTraits):
         
     def update_vertical_bounds(self):
 
-        idx = np.isfinite(self.data[self.data_to_plot])
-        min1 = np.min(self.data[self.data_to_plot][idx]) - 50
-        if self.show_diff:
-            idx2 = np.isfinite(self.data[self.diff_name])
-            min2 = np.min(self.data[self.diff_name][idx2] - 50)
-            min1 = np.min([min1, min2])
-        max1 = np.max(self.data[self.data_to_plot][idx])
+        if self.lod is None:
+            return
+
+        # extent of the visible time range only, from the envelope levels
+        low, high = self.rfcontainer.index_range.low, self.rfcontainer.index_range.high
+        min1, max1 = self.lod.extent(self.data_to_plot, low, high)
+        min1 -= 50
         if self.show_diff:
-            idx2 = np.isfinite(self.data[self.diff_name])
-            max2 = np.max(self.data[self.diff_name][idx2] + 50)
-            max1 = np.max([max1, max2])
-        
+            min2, max2 = self.lod.extent(self.diff_name, low, high)
+            min1 = np.fmin(min1, min2 - 50)
+            max1 = np.fmax(max1, max2 + 50)
+        if not (np.isfinite(min1) and np.isfinite(max1)):
+            # nothing to show in this range
+            return
+
         self.rfcontainer.value_range.set_bounds(min1, max1)
 
     def _reset_zoom_button_fired(self):
@@ -152,9 +188,24 @@ class RFTimeSeries(HasTraits):
             self.clearsky_name = 'lw_clearsky'
             self.diff_name = 'lw_diff'
         self.set_main_data_in_plot()
-        self.update_vertical_bounds()
         self.rfcontainer.request_redraw()
     
+    def _resolution_changed(self):
+
+        if self.data is None:
+            return
+
+        self.build_lod()
+        self.update_lod()
+        self.rfcontainer.request_redraw()
+
+    def _follow_changed(self):
+
+        if self.follow:
+            self.start_follow()
+        else:
+            self.stop_follow()
+
     def _show_clearsky_changed(self):
 
         if self.data is None:
@@ -175,17 +226,19 @@ class RFTimeSeries(HasTraits):
         self.update_vertical_bounds()
         self.rfcontainer.request_redraw()
     
+    @profiled('RFTimeSeries.open_year')
     def open_year(self, rf_file):
         
+        self.can_follow = False
         data = radflux_year_read(rf_file)
         if data is not None:
             self.time = data['time']
             self.date = data['date']
             self.data = data
-            self.data['sw_diff'] = self.data['total SW flux'] - self.data['sw_clearsky']
-            self.data['lw_diff'] = self.data['LW flux'] - self.data['lw_clearsky']
             self.meteo = meteo_year_read(self.date.year, os.path.dirname(rf_file))
+            add_clearsky(self.time, self.data, self.meteo)
             
+    @profiled('RFTimeSeries.open_day')
     def open_day(self, rf_file):
         
         time, data, date = radflux_read(rf_file)
@@ -195,39 +248,157 @@ class RFTimeSeries(HasTraits):
             self.date = date
             
             self.meteo = meteo_read(self.date, os.path.dirname(rf_file))
-            self.meteo['epochtime'] = self.meteo['time']
-            self.data['sw_clearsky'] = sw_clearsky(self.data['solar angle'])
-            self.data['lw_clearsky'] = lw_clearsky(self.meteo['temperature'], self.meteo['rh'])
-            
-            if len(self.time) < len(self.data['lw_clearsky']):
-                n = len(self.time)
-                self.data['lw_clearsky'] = self.data['lw_clearsky'][0:n]
-                self.data['sw_clearsky'] = self.data['sw_clearsky'][0:n]
-            
-            self.data['sw_diff'] = self.data['total SW flux'] - self.data['sw_clearsky']
-            self.data['lw_diff'] = self.data['LW flux'] - self.data['lw_clearsky']
-        
+            if self.meteo is not None:
+                self.meteo['epochtime'] = self.meteo['time']
+            add_clearsky(self.time, self.data, self.meteo)
+            self.rf_file = rf_file
+            self.can_follow = True
+        
+    def open_data_file(self, rf_file):
+        '''
+        opens a day (radflux_1a_*) or year radflux file, showing SW fluxes
+        '''
+
+        self.follow = False
+        if os.path.basename(rf_file).startswith('radflux_1a'):
+            self.open_day(rf_file)
+        else:
+            self.open_year(rf_file)
+        # default to SW
+        self.data_to_plot = 'total SW flux'
+        self.clearsky_name = 'sw_clearsky'
+        self.diff_name = 'sw_diff'
+
+    @profiled('RFTimeSeries.open_range')
+    def open_range(self, path, start, end):
+        '''
+        loads the station files of path in [start, end].
+        returns False, keeping the current data, if there is none in the range
+        '''
+        
+        self.follow = False
+        series = load_station_series(path, start, end)
+        if series is None:
+            return False
+        self.can_follow = False
+        self.time = series['time']
+        self.date = series['date']
+        self.data = series
+        self.meteo = series['meteo']
+        return True
+        
+    def start_follow(self):
+        '''
+        follows the open day file and its meteo file while they are written,
+        reading the new lines every follow_interval seconds
+        '''
+
+        if self.rf_file is None:
+            return
+        self.rf_follow = FollowReader(self.rf_file)
+        meteo_file = find_meteo_file(self.date, os.path.dirname(self.rf_file))
+        self.meteo_follow = FollowReader(meteo_file) if meteo_file is not None else None
+        # values computed from the radflux and meteo rows, on the radflux time axis
+        names = ['temperature', 'rh', 'sw_clearsky', 'lw_clearsky', 'sw_diff', 'lw_diff']
+        self.follow_columns = dict([(name, GrowableArray(dtype=storage['dtype'])) for name in names])
+        self.follow_update()
+        self.follow_timer = Timer(self.follow_interval * 1000, self.follow_update)
+
+    def stop_follow(self):
+
+        if self.follow_timer is not None:
+            self.follow_timer.Stop()
+        self.follow_timer = None
+        self.rf_follow = self.meteo_follow = None
+
+    @profiled('RFTimeSeries.follow_update')
+    def follow_update(self):
+        '''
+        appends the rows written since the last update. Clear-sky models and
+        differences are only computed for the new samples, and for the samples
+        the meteo file did not cover yet at the previous update.
+        '''
+
+        if self.rf_follow is None:
+            return
+        first, n = self.rf_follow.poll()
+        mfirst = mn = 0
+        if self.meteo_follow is not None:
+            mfirst, mn = self.meteo_follow.poll()
+        if n < 1 or (first == n and mfirst == mn):
+            return
+        if first == 0:
+            # first read, or the file was rewritten
+            self.lw_done = 0
+        end = self.time[-1] if first > 0 else None
+
+        time = self.rf_follow.time.data
+        x = self.rf_follow.values.data
+        columns = self.follow_columns
+        for name in columns:
+            columns[name].resize(n)
+
+        def out(names, i):
+            return dict([(name, columns[name].data[i:]) for name in names])
+
+        clearsky_batch(solar_angle=x[first:,0], sw=x[first:,3], out=out(['sw_clearsky', 'sw_diff'], first))
+
+        if self.meteo_follow is not None and mn > 0:
+            mtime = self.meteo_follow.time.data
+            mx = self.meteo_follow.values.data
+            self.meteo = {'time':mtime, 'epochtime':mtime, 'temperature':mx[:,2], 'rh':mx[:,3]}
+            i = min(first, self.lw_done)
+            aligned = align(mtime, {'temperature':mx[:,2], 'rh':mx[:,3]}, time[i:])
+            # later samples get their temperature at a next update
+            self.lw_done = np.searchsorted(time, mtime[-1], 'right')
+        else:
+            self.meteo = None
+            i = first
+            aligned = {'temperature':np.zeros(n - i) + np.nan, 'rh':np.zeros(n - i) + np.nan}
+        columns['temperature'].data[i:] = aligned['temperature']
+        columns['rh'].data[i:] = aligned['rh']
+        clearsky_batch(temp=aligned['temperature'], rh=aligned['rh'], lw=x[i:,4], out=out(['lw_clearsky', 'lw_diff'], i))
+
+        # the series are views of the follow buffers
+        self.time = time
+        self.data = {'solar angle':x[:,0], 'total SW flux':x[:,3], 'LW flux':x[:,4]}
+        for name in columns:
+            self.data[name] = columns[name].data
+
+        if end is None or self.lod is None:
+            self.set_data_in_plot()
+            return
+
+        if self.resolution == 'samples' and (self.tlod is None) == (self.meteo is None):
+            # only the blocks with new or recomputed samples are reduced again
+            self.lod.update(self.time, dict([(name, self.data[name]) for name in self.lod.values]), i)
+            if self.tlod is not None:
+                self.tlod.update(self.meteo['epochtime'], {'temperature':self.meteo['temperature']}, mfirst)
+        else:
+            self.build_lod()
+        self.rfcontainer.index_mapper.domain_limits = (self.time[0], self.time[-1])
+        if self.rfcontainer.index_range.high >= end:
+            # the view showed the latest samples, it keeps up with the new ones
+            self.rfcontainer.index_range.set_bounds(self.rfcontainer.index_range.low, self.time[-1])
+        self.update_lod()
+        self.rfcontainer.request_redraw()
+
+    @profiled('RFTimeSeries.save_multipage_pdf')
     def save_multipage_pdf(self, pdfname, plots_list):
+
+        # only needed to save figures
+        from reportlab.pdfgen import canvas
         
         c = canvas.Canvas(pdfname)
 
         for obj in plots_list:
-            
-            f = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-            filename = f.name
-            f.close()
-
-            window_size = obj.outer_bounds
-            gc = chaco.PlotGraphicsContext(window_size)
-            gc.render_component(obj)
-            gc.save(filename)
-
-            c.setPageSize(window_size)
-            c.drawInlineImage(filename, 0, 0)
+            # pages are rendered in memory, without going through an image file
+            c.setPageSize(obj.outer_bounds)
+            with stage('render page'):
+                image = component_image(obj)
+            c.drawInlineImage(image, 0, 0)
             c.showPage()
             
-            os.unlink(filename)
-            
         c.save()
            
     def save_image(self, imagefile):
@@ -235,12 +406,75 @@ class RFTimeSeries(HasTraits):
         print 'Save image ', imagefile
         self.save_multipage_pdf(imagefile, [self.rfcontainer, self.sacontainer, self.tcontainer])
         
+    def update_lod(self):
+        '''
+        puts in the plots the samples of the visible time range, decimated to
+        a min/max envelope about one block per pixel wide, or the raw samples
+        when zoomed in far enough
+        '''
+
+        if self.lod is None or self.updating_lod:
+            return
+
+        # a trait handler, so timed with a stage: a decorator would hide its arguments from traits
+        with stage('RFTimeSeries.update_lod'):
+            self.updating_lod = True
+            try:
+                low, high = self.rfcontainer.index_range.low, self.rfcontainer.index_range.high
+                npixels = max(int(self.rfcontainer.width), 100)
+                time, values = self.lod.window(low, high, npixels, [self.data_to_plot, self.clearsky_name, self.diff_name, 'solar angle'])
+                self.rfdata.set_data('index', time)
+                self.rfdata.set_data('value', values[self.data_to_plot])
+                self.rfdata.set_data('clearsky', values[self.clearsky_name])
+                self.rfdata.set_data('diff', values[self.diff_name])
+                self.sadata.set_data('index', time)
+                self.sadata.set_data('value', values['solar angle'])
+
+                if self.tlod is not None:
+                    npixels = max(int(self.tcontainer.width), 100)
+                    time, values = self.tlod.window(low, high, npixels)
+                    self.tdata.set_data('index', time)
+                    self.tdata.set_data('value', values['temperature'])
+
+                # autoscale follows zoom and pan
+                self.update_vertical_bounds()
+            finally:
+                self.updating_lod = False
+
+    @profiled('RFTimeSeries.build_lod')
+    def build_lod(self):
+        '''
+        min/max pyramids of everything that can be displayed, at the display
+        resolution, built once per loaded series and resolution
+        '''
+
+        names = [name for name in self.lod_names if name in self.data]
+        time, values = self.time, dict([(name, self.data[name]) for name in names])
+        if self.meteo is not None:
+            ttime, tvalues = self.meteo['epochtime'], {'temperature':self.meteo['temperature']}
+
+        if self.resolution != 'samples':
+            with stage('aggregate', resolution=self.resolution, samples=len(time)):
+                result = aggregate(time, values, self.resolutions[self.resolution])
+                time, values = result['time'], result['means']
+                if self.meteo is not None:
+                    result = aggregate(ttime, tvalues, self.resolutions[self.resolution])
+                    ttime, tvalues = result['time'], result['means']
+
+        with stage('envelopes', samples=len(time)):
+            self.lod = Envelope(time, values)
+            if self.meteo is not None:
+                self.tlod = Envelope(ttime, tvalues)
+        if self.meteo is None:
+            self.tlod = None
+            self.tdata.set_data('index', [])
+            self.tdata.set_data('value', [])
+
     def set_main_data_in_plot(self):
 
-        self.rfdata.set_data('value', self.data[self.data_to_plot])
-        self.rfdata.set_data('clearsky', self.data[self.clearsky_name])
-        self.rfdata.set_data('diff', self.data[self.diff_name])
+        self.update_lod()
         
+    @profiled('RFTimeSeries.set_data_in_plot')
     def set_data_in_plot(self):
         
         if self.data is None or self.rfcontainer is None or self.rfdata is None:
@@ -250,17 +484,12 @@ class RFTimeSeries(HasTraits):
         self.rfcontainer.y_axis.title = self.data_to_plot + ' (W/m2)'
         
         self.rfcontainer.title = self.plot_title
-        self.rfdata.set_data('index', self.time)
         self.rfcontainer.index_mapper.domain_limits = (self.time[0], self.time[-1])
-        self.set_main_data_in_plot()
-    
-        self.sadata.set_data('index', self.time)
-        self.sadata.set_data('value', self.data['solar angle'])
-        
-        self.tdata.set_data('index', self.meteo['epochtime'])
-        self.tdata.set_data('value', self.meteo['temperature'])
-        
+
+        self.build_lod()
         self._reset_zoom_button_fired()
+        # the zoom may not have changed, e.g. when the same file is opened again
+        self.update_lod()
  
     def init_triple_time_series(self, data, name1, name2, name3, title, label1, label2, label3):
         
@@ -298,6 +527,12 @@ class RFTimeSeries(HasTraits):
     def __init__(self, file_to_open=None, data_to_plot='NA', clearsky_name='NA', diff_name='NA'):
 
         self.data = None
+        self.lod = None
+        self.tlod = None
+        self.updating_lod = False
+        self.rf_file = None
+        self.follow_timer = None
+        self.rf_follow = self.meteo_follow = None
 
         self.rfdata = chaco.ArrayPlotData()
         self.rfdata.set_data('value', [])
@@ -319,6 +554,9 @@ class RFTimeSeries(HasTraits):
                                                 drag_button='left', always_on=True, restrict_to_data=True))
         self.rfcontainer.tools.append(PanTool(self.rfcontainer, drag_button='right', 
                                             constrain=True, constrain_direction='x', restrict_to_data=True))
+        # zoom, pan and resizes change the samples to show
+        self.rfcontainer.index_range.on_trait_change(self.update_lod, 'updated')
+        self.rfcontainer.on_trait_change(self.update_lod, 'bounds')
         
         self.sadata = chaco.ArrayPlotData()
         self.sadata.set_data('value', [])
@@ -332,6 +570,10 @@ class RFTimeSeries(HasTraits):
         self.tdata.set_data('index', [])
         plot = self.init_time_series(self.tdata, 'Temperature [degC]', self.rfcontainer.index_range, 'darkblue')
         self.tcontainer = plot
+
+        time_draws(self.rfcontainer, 'fluxes')
+        time_draws(self.sacontainer, 'solar angle')
+        time_draws(self.tcontainer, 'temperature')
         
         self.data_to_plot = data_to_plot
         self.clearsky_name = clearsky_name
@@ -353,6 +595,19 @@ class SWRFTimeSeries(RFTimeSeries):
         
 
 
+class DateRange(HasTraits):
+
+    start = Date
+    end = Date
+    
+    traits_view = View(
+        Item('start'),
+        Item('end'),
+        buttons=['OK', 'Cancel'],
+        title='Date range to open',
+    )
+
+
 class RFController(Handler):
 
     view = Instance(SWRFTimeSeries)
@@ -387,11 +642,27 @@ class RFController(Handler):
             return
 
         print 'Opening ' + datafile
-        if os.path.basename(datafile).startswith('radflux_1a'):
-            self.view.open_day(datafile)
-        else:
-            self.view.open_year(datafile)
-        # default to SW
+        self.view.open_data_file(datafile)
+        self.view.set_data_in_plot()
+
+    def open_range(self, ui_info):
+        
+        dd = DirectoryDialog(title='RadFlux data directory')
+        if dd.open() != OK:
+            return
+        
+        daterange = DateRange()
+        if not daterange.configure_traits(kind='livemodal'):
+            return
+        if daterange.start is None or daterange.end is None:
+            return
+        
+        print 'Opening ' + dd.path, daterange.start, daterange.end
+        # the end day is included
+        if not self.view.open_range(dd.path, daterange.start, daterange.end + timedelta(days=1)):
+            msg = MessageDialog(message='No RadFlux file in this date range', severity='warning', title='no data')
+            msg.open()
+            return
         self.view.data_to_plot = 'total SW flux'
         self.view.clearsky_name = 'sw_clearsky'
         self.view.diff_name = 'sw_diff'
@@ -407,6 +678,10 @@ class RFController(Handler):
         if fd.open() == OK:
             self.view.save_image(fd.path)
             
+    def performance(self, ui_info):
+
+        show_performance(parent=ui_info.ui.control)
+
     def about(self, ui_info):
         text = ['rfts.py', 'VNoel 2011-2014 CNRS', 'Radflux Time Series viewer', 'SIRTA']
         dlg = AboutDialog(parent=ui_info.ui.control, additions=text)
@@ -414,6 +689,13 @@ class RFController(Handler):
 
 
 def main():
+
+    parser = argparse.ArgumentParser(description='Radflux Time Series viewer')
+    parser.add_argument('--profile', nargs='?', const='-', metavar='FILE',
+                        help='time the load, compute and render stages, records go to stderr or FILE')
+    args = parser.parse_args()
+    if args.profile is not None:
+        set_profiling(True, args.profile)
     
     rftimeseries = SWRFTimeSeries()
     controller = RFController(view=rftimeseries)
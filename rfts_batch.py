@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+rfts_batch.py
+
+Headless batch rendering of the rfts figures (SW flux, solar angle and
+temperature pages) to one PDF per radflux file, without opening a window.
+
+Files are given on the command line, or found in the data catalog for a date
+range. They are distributed over a pool of worker processes, each building
+its own SWRFTimeSeries plots and rendering pages in memory.
+
+e.g.
+    rfts_batch.py -o figures data/radflux_1a_1min_v04_20100604_000000_1440.txt
+    rfts_batch.py -o figures --path data --start 2010-06-01 --end 2010-06-30
+"""
+
+import os
+import time
+import argparse
+import multiprocessing
+from datetime import datetime, timedelta
+
+# no GUI toolkit is needed to render the plots
+os.environ.setdefault('ETS_TOOLKIT', 'null')
+
+from radflux_api import get_catalog, to_epoch, set_profiling
+
+
+# outer bounds in pixels of the main plot and of the solar angle and temperature plots
+MAIN_SIZE = (1000, 400)
+SMALL_SIZE = (600, 300)
+
+
+def layout(component, size):
+
+    component.outer_bounds = list(size)
+    component.do_layout(force=True)
+
+
+def render_file(job):
+    '''
+    renders the figures of a radflux file to a PDF,
+    returns (rf_file, pdfname, pages, seconds, error)
+    '''
+
+    from rfts import SWRFTimeSeries
+
+    rf_file, outdir, show_clearsky, show_diff = job
+    pdfname = os.path.join(outdir, os.path.splitext(os.path.basename(rf_file))[0] + '.pdf')
+    t0 = time.time()
+    try:
+        view = SWRFTimeSeries()
+        # the decimation of the plotted series depends on the plot widths
+        layout(view.rfcontainer, MAIN_SIZE)
+        layout(view.sacontainer, SMALL_SIZE)
+        layout(view.tcontainer, SMALL_SIZE)
+        view.open_data_file(rf_file)
+        if view.data is None:
+            return rf_file, None, 0, time.time() - t0, 'no data'
+        view.set_data_in_plot()
+        view.show_clearsky = show_clearsky
+        view.show_diff = show_diff
+        plots = [view.rfcontainer, view.sacontainer, view.tcontainer]
+        view.save_multipage_pdf(pdfname, plots)
+    except Exception as e:
+        return rf_file, None, 0, time.time() - t0, str(e)
+    return rf_file, pdfname, len(plots), time.time() - t0, None
+
+
+def range_files(path, start, end, kind='radflux_day'):
+    '''
+    radflux files of a kind in path overlapping the days [start, end]
+    '''
+
+    t0 = to_epoch(start)
+    t1 = to_epoch(end + timedelta(days=1)) - 1.
+    return [f[2] for f in get_catalog(path).find(kind, t0, t1)]
+
+
+def render_batch(files, outdir, processes=None, show_clearsky=False, show_diff=False):
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    jobs = [(f, outdir, show_clearsky, show_diff) for f in files]
+    t0 = time.time()
+    npages, nfiles = 0, 0
+    if processes == 1:
+        results = (render_file(job) for job in jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(render_file, jobs)
+    try:
+        for rf_file, pdfname, pages, seconds, error in results:
+            if error is not None:
+                print 'Failed ', rf_file, ':', error
+                continue
+            nfiles += 1
+            npages += pages
+            print '%s (%d pages, %.2f s)' % (pdfname, pages, seconds)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.time() - t0
+    print '%d/%d files, %d pages in %.1f s: %.2f files/s, %.2f pages/s' % (nfiles, len(jobs), npages, elapsed,
+                                                                            nfiles / max(elapsed, 1e-9), npages / max(elapsed, 1e-9))
+    return nfiles, npages, elapsed
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Render rfts figures to PDF files, without a window')
+    parser.add_argument('files', nargs='*', help='radflux files')
+    parser.add_argument('-o', '--outdir', default='figures', help='output directory')
+    parser.add_argument('--path', default='data', help='data directory searched for a date range')
+    parser.add_argument('--start', help='first day of the date range, YYYY-MM-DD')
+    parser.add_argument('--end', help='last day of the date range, YYYY-MM-DD')
+    parser.add_argument('--year-files', action='store_true', help='use year files for the date range instead of day files')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--clearsky', action='store_true', help='show the clear-sky model')
+    parser.add_argument('--diff', action='store_true', help='show the difference with the clear-sky model')
+    parser.add_argument('--profile', nargs='?', const='-', metavar='FILE',
+                        help='time the load, compute and render stages, records go to stderr or FILE')
+    args = parser.parse_args()
+    # workers inherit the setting
+    if args.profile is not None:
+        set_profiling(True, args.profile)
+
+    files = list(args.files)
+    if args.start is not None:
+        start = datetime.strptime(args.start, '%Y-%m-%d')
+        end = datetime.strptime(args.end, '%Y-%m-%d') if args.end is not None else start
+        kind = 'radflux_year' if args.year_files else 'radflux_day'
+        files += range_files(args.path, start, end, kind)
+    if len(files) < 1:
+        parser.error('no radflux file to render')
+
+    render_batch(files, args.outdir, processes=args.processes, show_clearsky=args.clearsky, show_diff=args.diff)
+
+
+if __name__ == '__main__':
+    main()